@@ -0,0 +1,263 @@
+"""Non-interactive benchmark of the RAID 6 operations.
+
+Sweeps chunk size, disk count, data set, number of failed disks, disk backend and GF kernel, and reports the throughput and
+latency of every phase and the peak RSS of every configuration and phase, e.g.
+
+    python experiments/benchmark.py --chunk-sizes 4096 65536 --disks 5 7 --file-sizes 16 64 --mp3 --output results.json
+    python experiments/benchmark.py --baseline results.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import hashlib
+import threading
+import argparse
+import itertools
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+MP3_DIR = os.path.join(ROOT_DIR, 'data', 'experiment_data')
+
+PHASES = ['encode', 'read', 'scrub', 'rebuild']
+# Size of the pieces the data sets are generated and hashed in, so the harness itself holds little memory
+PIECE_SIZE = 1 << 20
+
+
+def make_array_dir(data_set, seed):
+    """Creates the directory layout main.py uses and fills 'files' with the data set, returns the directory and the SHA-256 of every file."""
+    array_dir = tempfile.mkdtemp(prefix='raid6_bench_')
+    for sub_dir in ['files', 'disks', 'Initial_distributed_files', 'Recovered_files', 'Reloaded_Initial_distributed_files']:
+        os.makedirs(os.path.join(array_dir, sub_dir))
+
+    files_dir = os.path.join(array_dir, 'files')
+    if data_set == 'mp3':
+        for filename in sorted(os.listdir(MP3_DIR)):
+            shutil.copy(os.path.join(MP3_DIR, filename), files_dir)
+    else:
+        # Synthetic data sets are named synthetic-<size>MB and are the same for the same seed
+        size = int(float(data_set.split('-')[1][:-2]) * (1 << 20))
+        rnd = random.Random(seed)
+        with open(os.path.join(files_dir, f'{data_set}.pdf'), 'wb') as f:
+            for offset in range(0, size, PIECE_SIZE):
+                f.write(rnd.randbytes(min(PIECE_SIZE, size - offset)))
+
+    digests = {}
+    for filename in os.listdir(files_dir):
+        with open(os.path.join(files_dir, filename), 'rb') as f:
+            digests[filename] = digest(iter(lambda: f.read(PIECE_SIZE), b''))
+    return array_dir, digests
+
+
+def digest(pieces):
+    sha = hashlib.sha256()
+    for piece in pieces:
+        sha.update(piece)
+    return sha.hexdigest()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    """Returns the resident set size of this process in MB, or the peak so far where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except OSError:
+        return peak_rss_mb()
+
+
+class RssSampler:
+    """Samples the RSS of this process on a background thread and keeps the RSS at the start and the peak of every phase."""
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.phases = {}
+        self._peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self._peak = max(self._peak, current_rss_mb())
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        start = current_rss_mb()
+        self._peak = start
+        try:
+            yield
+        finally:
+            self.phases[phase] = {'start_mb': start, 'peak_mb': max(self._peak, current_rss_mb())}
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def run_config(config):
+    """Runs the phases of one configuration once and returns the seconds and RSS per phase, the data size and the peak RSS."""
+    from src.raid6.RAID6_bin import RAID6
+    if config['backend'] == 'http':
+        import src.cloud_implementation.api_client as client
+        client.configure(base_url=config['server_url'])
+
+    array_dir, digests = make_array_dir(config['data_set'], config['seed'])
+    data_bytes = sum(os.path.getsize(os.path.join(array_dir, 'files', filename)) for filename in digests)
+    seconds = {}
+    rss = RssSampler()
+    try:
+        # The RAID6 progress output would dominate the benchmark output
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            with rss.phase('encode'):
+                start = time.perf_counter()
+                raid = RAID6(chunk_size=config['chunk_size'], num_disk=config['num_disk'], is_local=config['backend'] != 'http',
+                             dir=array_dir, backend=config['backend'], workers=config['workers'], kernel=config['kernel'])
+                raid.distribute_data(None)
+                seconds['encode'] = time.perf_counter() - start
+
+            # Files are read back as streams and only their digests are kept
+            with rss.phase('read'):
+                start = time.perf_counter()
+                read_digests = {filename: digest(raid.iter_file(filename)) for filename in digests}
+                seconds['read'] = time.perf_counter() - start
+
+            with rss.phase('scrub'):
+                start = time.perf_counter()
+                raid.scrub()
+                seconds['scrub'] = time.perf_counter() - start
+
+            if config['failed_disks']:
+                deleted_disks = list(range(config['failed_disks']))
+                with rss.phase('rebuild'):
+                    start = time.perf_counter()
+                    raid.delete_disk(deleted_disks)
+                    raid.rebuild_data(deleted_disks, recover_files=False)
+                    seconds['rebuild'] = time.perf_counter() - start
+                read_digests = {filename: digest(raid.iter_file(filename)) for filename in digests}
+    finally:
+        rss.stop()
+        shutil.rmtree(array_dir)
+
+    if read_digests != digests:
+        raise ValueError(f"Files read back differ from the originals for {config}")
+    return {'seconds': seconds, 'rss': rss.phases, 'data_bytes': data_bytes, 'peak_rss_mb': peak_rss_mb(), 'stats': raid.stats.as_dict()}
+
+
+def run_isolated(config):
+    """Runs one configuration in a fresh process so its peak RSS is not inflated by earlier configurations."""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_config, (config,))
+
+
+def benchmark(config, repeat):
+    """Runs a configuration repeat times and keeps the best time of every phase."""
+    runs = [run_isolated(config) for _ in range(repeat)]
+    data_mb = runs[0]['data_bytes'] / (1 << 20)
+    phases = {}
+    for phase in PHASES:
+        times = [run['seconds'][phase] for run in runs if phase in run['seconds']]
+        if times:
+            # The growth over the RSS at the start of a phase is what the phase itself holds in memory
+            rss = [run['rss'][phase] for run in runs]
+            phases[phase] = {'seconds': min(times), 'mb_per_s': data_mb / min(times) if min(times) else None, 'runs': times,
+                             'peak_rss_mb': max(r['peak_mb'] for r in rss), 'rss_growth_mb': max(r['peak_mb'] - r['start_mb'] for r in rss)}
+    # The internal phase counters of the last run show where the time of the operations went
+    return {'config': config, 'data_mb': data_mb, 'peak_rss_mb': max(run['peak_rss_mb'] for run in runs), 'phases': phases,
+            'stats': runs[-1]['stats']}
+
+
+def config_key(config):
+    return json.dumps({k: v for k, v in config.items() if k not in ('seed', 'server_url')}, sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """Prints the throughput change of every phase against the baseline and returns the regressions."""
+    baseline = {config_key(result['config']): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(config_key(result['config']))
+        if old is None:
+            continue
+        for phase, stats in result['phases'].items():
+            old_stats = old['phases'].get(phase)
+            if not old_stats or not old_stats['mb_per_s'] or not stats['mb_per_s']:
+                continue
+            change = stats['mb_per_s'] / old_stats['mb_per_s'] - 1
+            regressed = change < -tolerance
+            print(f"{'REGRESSION' if regressed else 'ok':10} {phase:8} {change:+7.1%}  {config_key(result['config'])}")
+            if regressed:
+                regressions.append((result['config'], phase, change))
+    return regressions
+
+
+def write_csv(results, path):
+    """Writes one row per configuration and phase."""
+    with open(path, 'w', newline='') as f:
+        writer = None
+        for result in results:
+            for phase, stats in result['phases'].items():
+                row = dict(result['config'], phase=phase, seconds=stats['seconds'], mb_per_s=stats['mb_per_s'],
+                           data_mb=result['data_mb'], peak_rss_mb=stats['peak_rss_mb'], rss_growth_mb=stats['rss_growth_mb'])
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[4096])
+    parser.add_argument('--disks', type=int, nargs='+', default=[7])
+    parser.add_argument('--file-sizes', type=float, nargs='+', default=[16], help="sizes of the synthetic files in MB")
+    parser.add_argument('--mp3', action='store_true', help=f"also run on the MP3 files in {MP3_DIR}")
+    parser.add_argument('--failed', type=int, nargs='+', default=[1, 2], help="number of disks to delete and rebuild")
+    parser.add_argument('--backends', nargs='+', default=['file'], choices=['file', 'mmap', 'memory', 'http'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--kernels', nargs='+', default=[None], choices=['numpy', 'stdlib'], help="GF kernels, by default the automatic choice")
+    parser.add_argument('--server-url', default='http://127.0.0.1:8000', help="disk server for the http backend")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per configuration, the best time of each phase is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--csv', help="write the results as CSV")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed relative throughput drop against the baseline")
+    args = parser.parse_args(argv)
+
+    data_sets = [f'synthetic-{size:g}MB' for size in args.file_sizes] + (['mp3'] if args.mp3 else [])
+    results = []
+    for chunk_size, num_disk, data_set, failed_disks, backend, workers, kernel in itertools.product(
+            args.chunk_sizes, args.disks, data_sets, args.failed, args.backends, args.workers, args.kernels):
+        config = {'chunk_size': chunk_size, 'num_disk': num_disk, 'data_set': data_set, 'failed_disks': failed_disks,
+                  'backend': backend, 'workers': workers, 'kernel': kernel, 'seed': args.seed, 'server_url': args.server_url}
+        result = benchmark(config, args.repeat)
+        results.append(result)
+        phases = '  '.join(f"{phase} {stats['seconds']:.3f}s {stats['mb_per_s']:.1f}MB/s +{stats['rss_growth_mb']:.0f}MB"
+                           for phase, stats in result['phases'].items())
+        print(f"chunk {chunk_size} disks {num_disk} {data_set} failed {failed_disks} {backend} workers {workers} kernel {kernel or 'auto'}: {phases}  rss {result['peak_rss_mb']:.0f}MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.csv:
+        write_csv(results, args.csv)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} phases are slower than the baseline")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,68 +1,190 @@
-import requests
-import base64
+import asyncio
+import atexit
+import threading
+
+import aiohttp
 
 # URL of the FastAPI server
 BASE_URL = "http://35.198.208.178:8000"
 
-def upload_to_disk(disk_number, chunk_data):
+# Maximum number of requests in flight at once, shared by all disks
+CONCURRENCY = 8
+# Number of attempts per request and the initial delay between them in seconds, doubled after every failure
+RETRIES = 4
+BACKOFF = 0.5
+# Size of the pieces request and response bodies are streamed in
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Errors the requests raise once their retries are used up
+ERRORS = (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError)
+
+_loop = None
+_session = None
+_semaphore = None
+_loop_lock = threading.Lock()
+
+
+def configure(base_url=None, concurrency=None, retries=None, backoff=None):
+    """Changes the server address and the connection settings, closing the current connection pool."""
+    global BASE_URL, CONCURRENCY, RETRIES, BACKOFF
+    close()
+    if base_url is not None:
+        BASE_URL = base_url
+    if concurrency is not None:
+        CONCURRENCY = concurrency
+    if retries is not None:
+        RETRIES = retries
+    if backoff is not None:
+        BACKOFF = backoff
+
+
+def _get_loop():
+    """Returns the event loop running the client in a background thread, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+def _run(coroutine):
+    """Runs a coroutine on the client loop and waits for its result, so the client can be used from synchronous code."""
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop()).result()
+
+
+async def _get_session():
+    """Returns the session whose connection pool is kept open and reused by all requests."""
+    global _session, _semaphore
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONCURRENCY))
+        _semaphore = asyncio.Semaphore(CONCURRENCY)
+    return _session
+
+
+async def _close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def close():
+    """Closes the pooled connections, a later request opens a new pool."""
+    if _loop is not None:
+        _run(_close_session())
+
+
+atexit.register(close)
+
+
+async def _stream(data):
+    """Yields the body in pieces, so it is sent with chunked transfer encoding without another copy."""
+    view = memoryview(data)
+    for start in range(0, len(view), STREAM_CHUNK_SIZE):
+        yield view[start:start + STREAM_CHUNK_SIZE]
+
+
+async def _request(method, path, data=None, headers=None):
+    """Sends a request and returns the status and body, retrying connection errors and server errors with backoff.
+
+    A POST creates a new file every time it reaches the server, so it is only retried if the connection could not be made;
+    retrying an upload whose response was lost would leave a second copy behind.
+    """
+    session = await _get_session()
+    idempotent = method != "POST"
+    delay = BACKOFF
+    for attempt in range(RETRIES):
+        last_attempt = attempt == RETRIES - 1
+        try:
+            async with _semaphore:
+                # The body generator is recreated for every attempt
+                body = _stream(data) if data is not None else None
+                async with session.request(method, f"{BASE_URL}{path}", data=body, headers=headers) as response:
+                    if response.status < 500 or last_attempt or not idempotent:
+                        content = bytearray()
+                        async for piece in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                            content += piece
+                        return response.status, bytes(content)
+        except aiohttp.ClientConnectorError:
+            # Nothing was sent
+            if last_attempt:
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if last_attempt or not idempotent:
+                raise
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+async def upload_to_disk_async(disk_number, chunk_data):
     """Uploads a binary chunk to the specified disk number"""
-    # Encode the binary chunk to base64
-    encoded_chunk = base64.b64encode(chunk_data).decode('utf-8')
-    
-    # Prepare the data payload
-    body = {
-        "disk_number": disk_number,
-        "chunk": encoded_chunk
-    }
-    
-    # Send the POST request
-    response = requests.post(f"{BASE_URL}/upload", json=body)
-    
-    # Check the response status
-    if response.status_code == 200:
-        response_data = response.json()
-        file_id = response_data.get("file_id")
-        print("Upload successful. File ID:", file_id)
-        return file_id
-    else:
-        print("Upload failed:", response.json())
-
-def get_disk_data(disk_number, file_id):
-    """Retrieves a binary chunk from the specified disk number"""
-    # Prepare the data payload
-    body = {
-        "disk_number": disk_number,
-        "file_id": file_id
-    }
-    
-    # Send the GET request
-    response = requests.get(f"{BASE_URL}/data", json=body)
-    
-    # Check the response status
-    if response.status_code == 200:
-        # Save the binary data to a file
-        print("File retrieved successfully and saved as 'retrieved_file'")
-        return response.content
-    else:
-        print("Failed to retrieve file:", response.json())
+    status, content = await _request("POST", f"/disks/{disk_number}/files", chunk_data)
+    if status != 200:
+        raise ConnectionError(f"Upload to disk {disk_number} failed: {content.decode(errors='replace')}")
+    return content.decode()
+
+
+async def get_disk_data_async(disk_number, file_id, offset=0, size=None):
+    """Retrieves a binary chunk from the specified disk number, only size bytes from offset if given"""
+    headers = None
+    if size is not None:
+        if size <= 0:
+            return b''
+        headers = {"Range": f"bytes={offset}-{offset + size - 1}"}
+    elif offset:
+        headers = {"Range": f"bytes={offset}-"}
+    status, content = await _request("GET", f"/disks/{disk_number}/files/{file_id}", headers=headers)
+    if status == 404:
+        print(f"File {file_id} not found on disk {disk_number}")
         return None
+    if status == 416:
+        # The range starts past the end of the file
+        return b''
+    if status not in (200, 206):
+        raise ConnectionError(f"Download from disk {disk_number} failed: {content.decode(errors='replace')}")
+    return content
+
+
+async def delete_file_async(disk_number, file_id):
+    """Deletes a file from the specified disk number"""
+    status, content = await _request("DELETE", f"/disks/{disk_number}/files/{file_id}")
+    if status not in (200, 404):
+        raise ConnectionError(f"Deleting from disk {disk_number} failed: {content.decode(errors='replace')}")
+
+
+def upload_to_disk(disk_number, chunk_data):
+    """Uploads a binary chunk to the specified disk number and returns its file id"""
+    return _run(upload_to_disk_async(disk_number, chunk_data))
+
+
+def get_disk_data(disk_number, file_id, offset=0, size=None):
+    """Retrieves a binary chunk from the specified disk number, or None if it does not exist"""
+    return _run(get_disk_data_async(disk_number, file_id, offset, size))
 
 
 def delete_file(disk_number, file_id):
-    """Resets the specified disk by deleting all files"""
-
-    body = {
-        "disk_number": disk_number,
-        "file_id": file_id
-    }
-    # Send the POST request with the disk number as a query parameter
-    response = requests.post(f"{BASE_URL}/reset", json=body)
-    
-    # Check the response status
-    if response.status_code == 200:
-        print(response.json()["message"])
-    else:
-        print("Failed to reset disk:", response.json())
+    """Deletes a file from the specified disk number"""
+    _run(delete_file_async(disk_number, file_id))
+
+
+async def _gather(coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+def upload_to_disks(chunks):
+    """Uploads (disk_number, chunk_data) pairs concurrently and returns their file ids in order"""
+    return _run(_gather([upload_to_disk_async(disk_number, chunk_data) for disk_number, chunk_data in chunks]))
+
+
+def get_disks_data(files):
+    """Retrieves (disk_number, file_id) pairs, optionally followed by offset and size, concurrently and returns their contents in order"""
+    return _run(_gather([get_disk_data_async(*file) for file in files]))
+
+
+def delete_files(files):
+    """Deletes (disk_number, file_id) pairs concurrently"""
+    _run(_gather([delete_file_async(disk_number, file_id) for disk_number, file_id in files]))
 
 
 # Example usage:
@@ -76,7 +198,6 @@ def delete_file(disk_number, file_id):
 # file_id = upload_to_disk(DISK, binary_data)
 
 # # Retrieve the file data using the disk number and file_id returned from the upload
-# # file_id = "YOUR_FILE_ID_HERE"  # Replace with the actual file_id returned from the upload
 # get_disk_data(DISK, file_id)
 
-# delete_file(DISK, file_id)
\ No newline at end of file
+# delete_file(DISK, file_id)
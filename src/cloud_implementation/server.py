@@ -1,17 +1,44 @@
+import os
+import re
+import threading
 from typing import Union
 from pydantic import BaseModel
 import gridfs
 from pymongo import MongoClient
 from bson import ObjectId
-from fastapi.responses import StreamingResponse
-from io import BytesIO
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 import base64
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 
 
 app = FastAPI()
 
+# "mongodb" stores the disks in the MongoDB instances, "mongomock" keeps them in memory so the server runs without MongoDB
+DISK_BACKEND = os.environ.get("DISK_BACKEND", "mongodb")
+# Size of the pieces bodies are streamed to and from GridFS in
+STREAM_CHUNK_SIZE = 1 << 20
+
+_disk_fs = {}
+_disk_fs_lock = threading.Lock()
+
+
+def get_disk_fs(disk_number):
+    """Returns the GridFS of a disk, its client is created once and reused for the lifetime of the process"""
+    with _disk_fs_lock:
+        if disk_number not in _disk_fs:
+            if DISK_BACKEND == "mongomock":
+                import mongomock
+                import mongomock.gridfs
+                mongomock.gridfs.enable_gridfs_integration()
+                client = mongomock.MongoClient()
+            else:
+                client = MongoClient(f'mongodb://localhost:2700{disk_number+1}')
+            _disk_fs[disk_number] = gridfs.GridFS(client.chunks)
+        return _disk_fs[disk_number]
+
+
 # Request model
 class ChunkData(BaseModel):
     disk_number: int
@@ -38,9 +65,7 @@ def upload_to_disk(chunk_data: ChunkData):
 
         chunk = base64.b64decode(encoded_chunk)
 
-        client = MongoClient(f'mongodb://localhost:2700{disk_number+1}')
-        db = client.chunks
-        fs = gridfs.GridFS(db)
+        fs = get_disk_fs(disk_number)
 
         # Store the binary data in GridFS with custom metadata
         file_id = fs.put(chunk)
@@ -59,18 +84,13 @@ def get_disk_data(chunk_request: ChunkRequest):
         disk_number = chunk_request.disk_number
         file_id = ObjectId(chunk_request.file_id)
 
-        client = MongoClient(f'mongodb://localhost:2700{disk_number+1}')
-        db = client.chunks
-        fs = gridfs.GridFS(db)
-        
+        fs = get_disk_fs(disk_number)
+
         # Retrieve the file from GridFS by its ObjectId
         stored_file = fs.get(file_id)
-        
-        # Read the binary data from the stored file
-        file_data = stored_file.read()
-        
+
         # Use StreamingResponse to send the file data to the client
-        return StreamingResponse(BytesIO(file_data), media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename={stored_file.filename}"})
+        return StreamingResponse(_read_pieces(stored_file, stored_file.length), media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename={stored_file.filename}"})
 
     except gridfs.errors.NoFile:
         raise HTTPException(status_code=404, detail="File not found")
@@ -85,14 +105,102 @@ def delete_file(delete_request: DeleteRequest):
 
         disk_number = delete_request.disk_number
         file_id = ObjectId(delete_request.file_id)
-        # Connect to the corresponding MongoDB instance
-        client = MongoClient(f'mongodb://localhost:2700{disk_number}')
-        db = client.chunks
-        fs = gridfs.GridFS(db)
+        fs = get_disk_fs(disk_number)
         fs.delete(file_id)
         # Drop the entire GridFS collection to delete all files
 
         return {"message": f"File {file_id} on disk {disk_number} has been deleted"}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _read_pieces(stored_file, size):
+    """Yields size bytes from the current position of a GridFS file in pieces of STREAM_CHUNK_SIZE"""
+    while size > 0:
+        piece = stored_file.read(min(STREAM_CHUNK_SIZE, size))
+        if not piece:
+            break
+        size -= len(piece)
+        yield piece
+
+
+def _parse_range(range_header, length):
+    """Returns the (start, end) byte positions of a single "bytes=start-end" range, end exclusive, or None if it cannot be satisfied"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip(), re.IGNORECASE)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        # A suffix range addresses the last bytes of the file
+        start, end = max(length - int(match.group(2)), 0), length
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)) + 1, length) if match.group(2) else length
+    if start >= end:
+        return None
+    return start, end
+
+
+@app.post("/disks/{disk_number}/files")
+async def upload_binary(disk_number: int, request: Request):
+    """Streams the raw request body into a new file on the specified disk and returns its id"""
+    try:
+        fs = get_disk_fs(disk_number)
+        stored_file = await run_in_threadpool(fs.new_file)
+        piece = bytearray()
+        async for data in request.stream():
+            piece += data
+            # The body is written to GridFS in fixed-size pieces instead of being collected in memory
+            if len(piece) >= STREAM_CHUNK_SIZE:
+                await run_in_threadpool(stored_file.write, bytes(piece))
+                piece = bytearray()
+        if piece:
+            await run_in_threadpool(stored_file.write, bytes(piece))
+        await run_in_threadpool(stored_file.close)
+
+        return Response(str(stored_file._id), media_type="text/plain")
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/disks/{disk_number}/files/{file_id}")
+def get_binary(disk_number: int, file_id: str, request: Request):
+    """Streams the raw content of a file on the specified disk, or the byte range given in the Range header"""
+    try:
+        fs = get_disk_fs(disk_number)
+        stored_file = fs.get(ObjectId(file_id))
+    except gridfs.errors.NoFile:
+        raise HTTPException(status_code=404, detail="File not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    length = stored_file.length
+    headers = {"Accept-Ranges": "bytes"}
+    range_header = request.headers.get("range")
+    # Ranges in other units than bytes are ignored, as RFC 7233 asks
+    if range_header is None or not range_header.strip().lower().startswith("bytes="):
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(_read_pieces(stored_file, length), media_type="application/octet-stream", headers=headers)
+
+    byte_range = _parse_range(range_header, length)
+    if byte_range is None:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+    start, end = byte_range
+    stored_file.seek(start)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(_read_pieces(stored_file, end - start), status_code=206, media_type="application/octet-stream", headers=headers)
+
+
+@app.delete("/disks/{disk_number}/files/{file_id}")
+def delete_binary(disk_number: int, file_id: str):
+    """Deletes a file from the specified disk"""
+    try:
+        fs = get_disk_fs(disk_number)
+        fs.delete(ObjectId(file_id))
+
+        return {"message": f"File {file_id} on disk {disk_number} has been deleted"}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,466 @@
+import io
+import os
+import mmap
+import threading
+import src.cloud_implementation.api_client as client
+
+
+class _BufferWriter(io.BytesIO):
+    """Collects the written bytes in memory and hands them to on_close when it is closed."""
+    def __init__(self, on_close):
+        super().__init__()
+        self._on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            self._on_close(self.getvalue())
+        super().close()
+
+
+class _SegmentWriter:
+    """Buffers what is written and hands it to flush(offset, data) whenever whole segments are complete, the rest on close."""
+    def __init__(self, segment_size, offset, flush, on_close=None):
+        self.segment_size = segment_size
+        self.offset = offset
+        self._flush = flush
+        self._on_close = on_close
+        self._buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        self._buffer += data
+        if len(self._buffer) >= self.segment_size:
+            size = len(self._buffer) - len(self._buffer) % self.segment_size
+            self._flush(self.offset, bytes(self._buffer[:size]))
+            del self._buffer[:size]
+            self.offset += size
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self._buffer:
+                self._flush(self.offset, bytes(self._buffer))
+                self._buffer = bytearray()
+            if self._on_close is not None:
+                self._on_close()
+
+
+class _ReplacingFile:
+    """Writes a disk image next to the old one and moves it into place on close, then calls on_close if given."""
+    def __init__(self, path, on_close=None):
+        self.path = path
+        self._on_close = on_close
+        # Writing next to the image keeps any mapping of the old image valid until it is replaced
+        self.file = open(f'{path}.tmp', 'wb')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.replace(f'{self.path}.tmp', self.path)
+            if self._on_close is not None:
+                self._on_close()
+
+
+# Storage of the disk images of one array, addressed by disk index and byte offset
+class DiskBackend:
+    def exists(self, disk_index):
+        """Returns whether the disk is present."""
+        return self.size(disk_index) is not None
+
+    def size(self, disk_index):
+        """Returns the size of the disk image in bytes, or None if the disk is missing."""
+        raise NotImplementedError
+
+    def read_at(self, disk_index, offset, size):
+        """Reads up to size bytes at offset, or returns None if the disk is missing."""
+        raise NotImplementedError
+
+    def write_at(self, disk_index, offset, data):
+        """Overwrites the disk image at offset, extending it if the data runs past its end."""
+        self.write_many(disk_index, [(offset, data)])
+
+    def write_many(self, disk_index, writes):
+        """Overwrites several (offset, data) regions of one disk image."""
+        for offset, data in writes:
+            self.write_at(disk_index, offset, data)
+
+    def append(self, disk_index, data):
+        """Writes data after the end of the disk image."""
+        self.write_at(disk_index, self.size(disk_index) or 0, data)
+
+    def truncate(self, disk_index, size):
+        """Cuts the disk image down to size bytes."""
+        raise NotImplementedError
+
+    def delete(self, disk_index):
+        """Removes the disk image and its label, as if the disk failed."""
+        raise NotImplementedError
+
+    def read_label(self, disk_index):
+        """Returns the small label stored on the disk next to its image, or None if there is none."""
+        raise NotImplementedError
+
+    def write_label(self, disk_index, label):
+        """Stores the label of the disk."""
+        raise NotImplementedError
+
+    def view(self, disk_index, size):
+        """Returns the first size bytes of the disk image as a buffer, or None if the disk is missing."""
+        return self.read_at(disk_index, 0, size)
+
+    def writer(self, disk_index, offset=0):
+        """Returns a file-like output that overwrites the disk image sequentially from offset."""
+        return _BufferWriter(lambda data: self.write_at(disk_index, offset, data))
+
+    def replacer(self, disk_index):
+        """Returns a file-like output whose content replaces the whole disk image once it is closed."""
+        return _BufferWriter(lambda data: self.replace(disk_index, data))
+
+    def replace(self, disk_index, data):
+        """Replaces the whole disk image."""
+        if self.exists(disk_index):
+            self.delete(disk_index)
+        self.write_at(disk_index, 0, data)
+
+    def delete_replaced(self):
+        """Deletes the stored data that writes replaced, once the metadata saved since no longer refers to it."""
+
+
+# Disk images as files disk_{i} in a directory
+class FileDisks(DiskBackend):
+    def __init__(self, disks_dir):
+        self.disks_dir = disks_dir
+
+    def path(self, disk_index):
+        return os.path.join(self.disks_dir, f'disk_{disk_index}')
+
+    def label_path(self, disk_index):
+        return os.path.join(self.disks_dir, f'disk_{disk_index}.label')
+
+    def size(self, disk_index):
+        if not os.path.exists(self.path(disk_index)):
+            return None
+        return os.path.getsize(self.path(disk_index))
+
+    def read_at(self, disk_index, offset, size):
+        if not os.path.exists(self.path(disk_index)):
+            return None
+        with open(self.path(disk_index), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def write_many(self, disk_index, writes):
+        mode = 'r+b' if os.path.exists(self.path(disk_index)) else 'wb'
+        with open(self.path(disk_index), mode) as f:
+            for offset, data in writes:
+                f.seek(offset)
+                f.write(data)
+
+    def truncate(self, disk_index, size):
+        if os.path.exists(self.path(disk_index)):
+            with open(self.path(disk_index), 'r+b') as f:
+                f.truncate(size)
+
+    def delete(self, disk_index):
+        os.remove(self.path(disk_index))
+        if os.path.exists(self.label_path(disk_index)):
+            os.remove(self.label_path(disk_index))
+
+    def read_label(self, disk_index):
+        if not os.path.exists(self.label_path(disk_index)):
+            return None
+        with open(self.label_path(disk_index), 'rb') as f:
+            return f.read()
+
+    def write_label(self, disk_index, label):
+        # The label is replaced atomically, so a crash leaves either the old or the new one
+        with open(f'{self.label_path(disk_index)}.tmp', 'wb') as f:
+            f.write(label)
+        os.replace(f'{self.label_path(disk_index)}.tmp', self.label_path(disk_index))
+
+    def writer(self, disk_index, offset=0):
+        f = open(self.path(disk_index), 'r+b' if os.path.exists(self.path(disk_index)) else 'wb')
+        f.seek(offset)
+        return f
+
+    def replacer(self, disk_index):
+        return _ReplacingFile(self.path(disk_index))
+
+
+# Disk image files that are read through memory mappings instead of file reads
+class MmapDisks(FileDisks):
+    def __init__(self, disks_dir):
+        super().__init__(disks_dir)
+        # One read-only mapping per disk image, mapped again when the image grew and dropped when it is cut or replaced
+        self._mappings = {}
+        self._mappings_lock = threading.Lock()
+
+    def _mapping(self, disk_index, end):
+        """Returns the mapping of a disk image, remapped if it ends before end and the image has grown; None if the disk is missing or empty."""
+        with self._mappings_lock:
+            mapping = self._mappings.get(disk_index)
+            if mapping is None or len(mapping) < end:
+                size = self.size(disk_index)
+                if not size:
+                    self._mappings.pop(disk_index, None)
+                    return None
+                if mapping is None or size > len(mapping):
+                    with open(self.path(disk_index), 'rb') as f:
+                        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._mappings[disk_index] = mapping
+            return mapping
+
+    def _drop_mapping(self, disk_index):
+        # The mapping is not closed, buffers handed out earlier keep it alive until they are released
+        with self._mappings_lock:
+            self._mappings.pop(disk_index, None)
+
+    def read_at(self, disk_index, offset, size):
+        mapping = self._mapping(disk_index, offset + size)
+        if mapping is None:
+            return super().read_at(disk_index, offset, size)
+        # A slice of the mapping lets the page cache serve the chunks without copying them
+        return memoryview(mapping)[offset:offset + size]
+
+    def truncate(self, disk_index, size):
+        # Pages past the new end must not stay mapped, touching them would fault
+        self._drop_mapping(disk_index)
+        super().truncate(disk_index, size)
+
+    def delete(self, disk_index):
+        self._drop_mapping(disk_index)
+        super().delete(disk_index)
+
+    def replacer(self, disk_index):
+        return _ReplacingFile(self.path(disk_index), lambda: self._drop_mapping(disk_index))
+
+
+# Disk images kept in memory, e.g. to measure encoding without disk I/O
+class MemoryDisks(DiskBackend):
+    def __init__(self):
+        self.disks = {}
+        self.labels = {}
+
+    def size(self, disk_index):
+        disk = self.disks.get(disk_index)
+        return None if disk is None else len(disk)
+
+    def read_at(self, disk_index, offset, size):
+        disk = self.disks.get(disk_index)
+        if disk is None:
+            return None
+        return bytes(disk[offset:offset + size])
+
+    def write_at(self, disk_index, offset, data):
+        disk = self.disks.setdefault(disk_index, bytearray())
+        if offset > len(disk):
+            disk.extend(bytes(offset - len(disk)))
+        disk[offset:offset + len(data)] = data
+
+    def truncate(self, disk_index, size):
+        if disk_index in self.disks:
+            del self.disks[disk_index][size:]
+
+    def delete(self, disk_index):
+        del self.disks[disk_index]
+        self.labels.pop(disk_index, None)
+
+    def read_label(self, disk_index):
+        return self.labels.get(disk_index)
+
+    def write_label(self, disk_index, label):
+        self.labels[disk_index] = bytes(label)
+
+    def replace(self, disk_index, data):
+        self.disks[disk_index] = bytearray(data)
+
+
+# Disk images on the disk server, stored as segments of at most segment_stripes stripes
+class HttpDisks(DiskBackend):
+    def __init__(self, chunk_size, segment_stripes, segments, total_stripes=0, labels=None):
+        """segments maps str(disk_index) to a list of dicts with file_id, start_stripe and num_stripes and labels maps
+        str(disk_index) to the file id of the disk's label; both are updated in place."""
+        self.chunk_size = chunk_size
+        self.segment_stripes = segment_stripes
+        self.segments = segments
+        self.labels = labels if labels is not None else {}
+        # (disk_index, file_id) of replaced segments and labels; the saved metadata may still refer to them until the next save
+        self.replaced_files = []
+        for key, disk_segments in segments.items():
+            if isinstance(disk_segments, str):
+                # Older arrays store each disk as a single blob
+                segments[key] = [{'file_id': disk_segments, 'start_stripe': 0, 'num_stripes': total_stripes}] if disk_segments else []
+
+    def disk_segments(self, disk_index):
+        return self.segments.get(str(disk_index), [])
+
+    def size(self, disk_index):
+        disk_segments = self.disk_segments(disk_index)
+        if not disk_segments:
+            return None
+        return max(segment['start_stripe'] + segment['num_stripes'] for segment in disk_segments) * self.chunk_size
+
+    def read_at(self, disk_index, offset, size):
+        # Only the overlapping bytes of the segments in the range are downloaded
+        requests = []
+        for segment in self.disk_segments(disk_index):
+            segment_offset = segment['start_stripe'] * self.chunk_size
+            segment_end = segment_offset + segment['num_stripes'] * self.chunk_size
+            if segment_end <= offset or segment_offset >= offset + size:
+                continue
+            start = max(offset, segment_offset)
+            requests.append((disk_index, segment['file_id'], start - segment_offset, min(offset + size, segment_end) - start))
+        if not requests:
+            return None if size else b''
+        try:
+            segment_contents = client.get_disks_data(requests)
+        except client.ERRORS as error:
+            # An unreachable disk server counts as a failed disk
+            print(f"Disk {disk_index} could not be read: {error}")
+            return None
+        if any(segment_content is None for segment_content in segment_contents):
+            return None
+        return b''.join(segment_contents)
+
+    def write_many(self, disk_index, writes):
+        disk_size = self.size(disk_index) or 0
+        patches = []
+        for offset, data in writes:
+            if offset + len(data) > disk_size:
+                # The part past the end is uploaded as new segments
+                tail_offset = max(offset, disk_size)
+                tail = bytes(tail_offset - disk_size) + bytes(data[tail_offset - offset:])
+                self._upload_segments(disk_index, disk_size // self.chunk_size, tail)
+                disk_size += len(tail)
+                data = data[:max(tail_offset - offset, 0)]
+            if len(data):
+                patches.append((offset, data))
+        if patches:
+            self._patch_segments(disk_index, patches)
+
+    def _patch_segments(self, disk_index, writes):
+        # Remote segments are immutable, so only the touched segments are replaced
+        touched_segments = []
+        for segment in self.disk_segments(disk_index):
+            segment_offset = segment['start_stripe'] * self.chunk_size
+            segment_end = segment_offset + segment['num_stripes'] * self.chunk_size
+            touched = [(offset, data) for offset, data in writes if offset < segment_end and offset + len(data) > segment_offset]
+            if touched:
+                covered = sum(min(offset + len(data), segment_end) - max(offset, segment_offset) for offset, data in touched)
+                touched_segments.append((segment, touched, covered == segment_end - segment_offset))
+        if not touched_segments:
+            return
+
+        # A segment that is overwritten completely does not need to be downloaded first
+        downloads = [(disk_index, segment['file_id'], 0, segment['num_stripes'] * self.chunk_size) for segment, _, whole in touched_segments if not whole]
+        downloaded = iter(client.get_disks_data(downloads))
+        replaced = {}
+        uploads = []
+        for segment, touched, whole in touched_segments:
+            segment_offset = segment['start_stripe'] * self.chunk_size
+            segment_content = bytearray(segment['num_stripes'] * self.chunk_size)
+            if not whole:
+                old_content = next(downloaded)
+                segment_content[:len(old_content)] = old_content
+            for offset, data in touched:
+                start = max(offset, segment_offset)
+                end = min(offset + len(data), segment_offset + len(segment_content))
+                segment_content[start - segment_offset:end - segment_offset] = data[start - offset:end - offset]
+            # Segments larger than segment_stripes, e.g. from older arrays, are split up when they are replaced
+            replaced[segment['file_id']] = self._split_segments(segment['start_stripe'], segment_content)
+            uploads += replaced[segment['file_id']]
+
+        file_ids = iter(client.upload_to_disks([(disk_index, content) for _, _, content in uploads]))
+        segments = []
+        for segment in self.disk_segments(disk_index):
+            if segment['file_id'] not in replaced:
+                segments.append(segment)
+                continue
+            for start_stripe, num_stripes, _ in replaced[segment['file_id']]:
+                segments.append({'file_id': next(file_ids), 'start_stripe': start_stripe, 'num_stripes': num_stripes})
+        self.segments[str(disk_index)] = segments
+        self.replaced_files += [(disk_index, file_id) for file_id in replaced]
+
+    def _split_segments(self, start_stripe, content):
+        """Splits the content of consecutive stripes into (start_stripe, num_stripes, content) segments of at most segment_stripes stripes."""
+        segment_size = self.segment_stripes * self.chunk_size
+        view = memoryview(content)
+        return [(start_stripe + offset // self.chunk_size, len(view[offset:offset + segment_size]) // self.chunk_size, view[offset:offset + segment_size])
+                for offset in range(0, len(view), segment_size)]
+
+    def _upload_segments(self, disk_index, start_stripe, content):
+        """Uploads the content of the stripes from start_stripe as new segments after the existing ones."""
+        self.segments[str(disk_index)] = self.disk_segments(disk_index) + self._upload_new_segments(disk_index, start_stripe, content)
+
+    def _upload_new_segments(self, disk_index, start_stripe, content):
+        """Uploads the content of the stripes from start_stripe and returns the segments holding it, without adding them to the disk."""
+        new_segments = self._split_segments(start_stripe, content)
+        file_ids = client.upload_to_disks([(disk_index, segment_content) for _, _, segment_content in new_segments])
+        return [{'file_id': file_id, 'start_stripe': segment_start, 'num_stripes': num_stripes}
+                for file_id, (segment_start, num_stripes, _) in zip(file_ids, new_segments)]
+
+    def truncate(self, disk_index, size):
+        num_stripes = size // self.chunk_size
+        segments = []
+        dropped = []
+        for segment in self.disk_segments(disk_index):
+            if segment['start_stripe'] >= num_stripes:
+                dropped.append((disk_index, segment['file_id']))
+            else:
+                segments.append(dict(segment, num_stripes=min(segment['num_stripes'], num_stripes - segment['start_stripe'])))
+        self.segments[str(disk_index)] = segments
+        self.replaced_files += dropped
+
+    def delete(self, disk_index):
+        files = [(disk_index, segment['file_id']) for segment in self.disk_segments(disk_index)]
+        if str(disk_index) in self.labels:
+            files.append((disk_index, self.labels.pop(str(disk_index))))
+        client.delete_files(files)
+        self.segments[str(disk_index)] = []
+
+    def read_label(self, disk_index):
+        # Reading the label also shows whether the disk server still has the disk
+        file_id = self.labels.get(str(disk_index))
+        if file_id is None:
+            return None
+        try:
+            return client.get_disk_data(disk_index, file_id)
+        except client.ERRORS as error:
+            print(f"Label of disk {disk_index} could not be read: {error}")
+            return None
+
+    def write_label(self, disk_index, label):
+        old_file_id = self.labels.get(str(disk_index))
+        self.labels[str(disk_index)] = client.upload_to_disk(disk_index, label)
+        if old_file_id is not None:
+            self.replaced_files.append((disk_index, old_file_id))
+
+    def replace(self, disk_index, data):
+        self._swap_segments(disk_index, self._upload_new_segments(disk_index, 0, data))
+
+    def _swap_segments(self, disk_index, new_segments):
+        """Makes new_segments the disk's segments, the old ones are deleted from the disk server by delete_replaced."""
+        old_segments = self.disk_segments(disk_index)
+        self.segments[str(disk_index)] = new_segments
+        self.replaced_files += [(disk_index, segment['file_id']) for segment in old_segments]
+
+    def delete_replaced(self):
+        replaced_files, self.replaced_files = self.replaced_files, []
+        if replaced_files:
+            client.delete_files(replaced_files)
+
+    def writer(self, disk_index, offset=0):
+        # Every segment is uploaded as soon as it is complete, so only one segment per disk is held in memory
+        return _SegmentWriter(self.segment_stripes * self.chunk_size, offset, lambda offset, data: self.write_at(disk_index, offset, data))
+
+    def replacer(self, disk_index):
+        # The old segments stay the disk's content until the new image is complete
+        new_segments = []
+        return _SegmentWriter(self.segment_stripes * self.chunk_size, 0,
+                              lambda offset, data: new_segments.extend(self._upload_new_segments(disk_index, offset // self.chunk_size, data)),
+                              lambda: self._swap_segments(disk_index, new_segments))
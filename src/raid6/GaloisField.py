@@ -1,24 +1,102 @@
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy every operation runs on the stdlib kernel
+    np = None
+
+# Lookup tables are shared by every GF instance with the same parameters
+_TABLE_CACHE = {}
+
+
+def _build_tables(primitive_polynomial, field_size):
+    """Builds the log/exp tables and the full product, quotient and inverse tables of the field."""
+    exp_table = [0] * (2 * field_size)
+    log_table = [0] * field_size
+    x = 1
+    for i in range(field_size - 1):
+        exp_table[i] = x
+        log_table[x] = i
+        x <<= 1
+        if x & field_size:
+            x ^= primitive_polynomial
+    for i in range(field_size - 1, 2 * field_size - 2):
+        exp_table[i] = exp_table[i - (field_size - 1)]
+
+    if np is None:
+        # bytes rows are all the stdlib kernel needs, one bytes.translate table per constant
+        mul_rows = [bytes(exp_table[log_table[x] + log_table[y]] if x and y else 0 for y in range(field_size)) for x in range(field_size)]
+        return {
+            'exp_table': exp_table,
+            'log_table': log_table,
+            'mul_full': None,
+            'div_full': None,
+            'inv_full': None,
+            'mul_rows': mul_rows,
+            'inv_bytes': bytes([0] + [exp_table[(field_size - 1 - log_table[x]) % (field_size - 1)] for x in range(1, field_size)]),
+        }
+
+    # Full product table: mul_full[x, y] = x * y, zero row and column stay 0
+    exp_arr = np.array(exp_table, dtype=np.uint8)
+    log_arr = np.array(log_table, dtype=np.int64)
+    mul_full = np.zeros((field_size, field_size), dtype=np.uint8)
+    mul_full[1:, 1:] = exp_arr[(log_arr[1:, None] + log_arr[None, 1:]) % (field_size - 1)]
+
+    # Inverses and full quotient table: div_full[x, y] = x / y, the y = 0 column is undefined and left 0
+    inv_full = np.zeros(field_size, dtype=np.uint8)
+    inv_full[1:] = exp_arr[(-log_arr[1:]) % (field_size - 1)]
+    div_full = mul_full[:, inv_full]
+    div_full[:, 0] = 0
+
+    for table in (exp_arr, mul_full, inv_full, div_full):
+        table.setflags(write=False)
+
+    return {
+        'exp_table': exp_table,
+        'log_table': log_table,
+        'mul_full': mul_full,
+        'div_full': div_full,
+        'inv_full': inv_full,
+        'mul_rows': [row.tobytes() for row in mul_full],
+        'inv_bytes': inv_full.tobytes(),
+    }
+
+
+def _as_array(buffer):
+    """Returns a uint8 view of bytes, bytearray, memoryview or NumPy data without copying."""
+    if isinstance(buffer, np.ndarray):
+        return buffer.view(np.uint8) if buffer.dtype != np.uint8 else buffer
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+
+def _xor_bytes(a, b):
+    """XORs two equally long buffers as wide integers, a handful of C-level calls instead of a loop over the bytes."""
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
 
 
 # Galois Field Operations
 class GF:
-    def __init__(self, primitive_polynomial=0x11d, field_size=256):
+    def __init__(self, primitive_polynomial=0x11d, field_size=256, use_numpy=None):
+        """use_numpy selects the NumPy kernels for buffer operations, by default whenever NumPy is installed."""
         self.field_size = field_size
         self.primitive_polynomial = primitive_polynomial
-        self.exp_table = [0] * (2 * field_size)
-        self.log_table = [0] * field_size
+        if use_numpy and np is None:
+            raise ValueError("NumPy is not installed")
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
         self._init_tables()
 
     def _init_tables(self):
-        x = 1
-        for i in range(self.field_size - 1):
-            self.exp_table[i] = x
-            self.log_table[x] = i
-            x <<= 1
-            if x & self.field_size:
-                x ^= self.primitive_polynomial
-        for i in range(self.field_size - 1, 2 * self.field_size - 2):
-            self.exp_table[i] = self.exp_table[i - (self.field_size - 1)]
+        key = (self.primitive_polynomial, self.field_size)
+        tables = _TABLE_CACHE.get(key)
+        if tables is None:
+            tables = _build_tables(self.primitive_polynomial, self.field_size)
+            _TABLE_CACHE[key] = tables
+        self.exp_table = tables['exp_table']
+        self.log_table = tables['log_table']
+        self.mul_full = tables['mul_full']
+        self.div_full = tables['div_full']
+        self.inv_full = tables['inv_full']
+        self._mul_rows = tables['mul_rows']
+        self._inv_bytes = tables['inv_bytes']
 
     def add(self, x, y):
         return x ^ y
@@ -27,16 +105,97 @@ class GF:
         return x ^ y
 
     def mul(self, x, y):
-        if x == 0 or y == 0:
-            return 0
-        return self.exp_table[(self.log_table[x] + self.log_table[y]) % (self.field_size - 1)]
+        return self._mul_rows[x][y]
 
     def div(self, x, y):
         if y == 0:
             raise ZeroDivisionError()
-        if x == 0:
-            return 0
-        return self.exp_table[(self.log_table[x] - self.log_table[y]) % (self.field_size - 1)]
+        return self._mul_rows[x][self._inv_bytes[y]]
 
     def exp(self, x):
-        return self.exp_table[x % (self.field_size - 1)]
\ No newline at end of file
+        return self.exp_table[x % (self.field_size - 1)]
+
+    def inv(self, x):
+        """Returns the multiplicative inverse of a scalar or of every byte in a buffer."""
+        if isinstance(x, int):
+            if x == 0:
+                raise ZeroDivisionError()
+            return self._inv_bytes[x]
+        if not self.use_numpy:
+            values = bytes(x)
+            if 0 in values:
+                raise ZeroDivisionError()
+            return values.translate(self._inv_bytes)
+        values = _as_array(x)
+        if not values.all():
+            raise ZeroDivisionError()
+        return self.inv_full[values]
+
+    def mul_table(self, c):
+        """Returns the 256-entry lookup table for multiplication by the constant c, a uint8 array or bytes for the stdlib kernel."""
+        return self.mul_full[c] if self.use_numpy else self._mul_rows[c]
+
+    def mul_vec(self, buffer, const):
+        """Multiplies every byte of the buffer by const and returns the result as a new uint8 array, or bytes for the stdlib kernel."""
+        if not self.use_numpy:
+            return bytes(buffer).translate(self._mul_rows[const])
+        return self.mul_full[const][_as_array(buffer)]
+
+    def div_vec(self, buffer, const):
+        """Divides every byte of the buffer by const and returns the result as a new uint8 array, or bytes for the stdlib kernel."""
+        if const == 0:
+            raise ZeroDivisionError()
+        return self.mul_vec(buffer, self._inv_bytes[const])
+
+    def xor(self, a, b):
+        """Returns a ^ b of two equally long buffers as a new uint8 array, or bytes for the stdlib kernel."""
+        if not self.use_numpy:
+            return _xor_bytes(bytes(a), bytes(b))
+        return np.bitwise_xor(_as_array(a), _as_array(b))
+
+    def mul_add_into(self, dst, src, const):
+        """Computes dst ^= const * src in place; dst must be a writable buffer of the same length as src."""
+        if not self.use_numpy:
+            if const != 0:
+                # bytes.translate multiplies the whole buffer through the 256-byte table of const
+                src = bytes(src) if const == 1 else bytes(src).translate(self._mul_rows[const])
+                memoryview(dst).cast('B')[:] = _xor_bytes(bytes(dst), src)
+            return dst
+        out = _as_array(dst)
+        if const == 1:
+            np.bitwise_xor(out, _as_array(src), out=out)
+        elif const != 0:
+            np.bitwise_xor(out, self.mul_full[const][_as_array(src)], out=out)
+        return dst
+
+    def linear_combination(self, sources, coefficients):
+        """Returns the sum of coefficient * source over equally long buffers, a uint8 array or bytes for the stdlib kernel."""
+        if not self.use_numpy:
+            # The sum is accumulated as one wide integer and only converted back to bytes once
+            size = len(memoryview(sources[0]).cast('B'))
+            total = 0
+            for source, coefficient in zip(sources, coefficients):
+                if coefficient:
+                    total ^= int.from_bytes(bytes(source).translate(self._mul_rows[coefficient]), 'little')
+            return total.to_bytes(size, 'little')
+        out = np.zeros(len(memoryview(sources[0]).cast('B')), dtype=np.uint8)
+        for source, coefficient in zip(sources, coefficients):
+            self.mul_add_into(out, _as_array(source).reshape(-1), coefficient)
+        return out
+
+    def inv_matrix(self, matrix):
+        """Inverts a square matrix over the field by Gauss-Jordan elimination; raises ValueError if it is singular."""
+        size = len(matrix)
+        rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+        for col in range(size):
+            pivot = next((r for r in range(col, size) if rows[r][col]), None)
+            if pivot is None:
+                raise ValueError("Matrix is singular")
+            rows[col], rows[pivot] = rows[pivot], rows[col]
+            scale = self.inv(rows[col][col])
+            rows[col] = [self.mul(v, scale) for v in rows[col]]
+            for r in range(size):
+                factor = rows[r][col]
+                if r != col and factor:
+                    rows[r] = [v ^ self.mul(factor, w) for v, w in zip(rows[r], rows[col])]
+        return [row[size:] for row in rows]
@@ -0,0 +1,57 @@
+# Placement of the P and Q parity chunks
+class ParityLayout:
+    def __init__(self, num_disk):
+        """Keeps the P disk of every stripe; the rotation restarts at the first stripe of each file."""
+        self.num_disk = num_disk
+        self.p_disks = bytearray()
+
+        # Data disks of a stripe only depend on where P sits, so precompute them per rotation position
+        self.data_disks_by_p = []
+        for p_disk in range(num_disk):
+            q_disk = (p_disk + 1) % num_disk
+            self.data_disks_by_p.append(tuple(d for d in range(num_disk) if d != p_disk and d != q_disk))
+
+    @classmethod
+    def from_file_metadata(cls, num_disk, file_metadata, total_stripes=0):
+        """Builds the layout of an array from the stripe ranges stored in its file metadata."""
+        layout = cls(num_disk)
+        layout.p_disks = bytearray(max(total_stripes, 0))
+        for metadata in file_metadata.values():
+            start_stripe = metadata['start_stripe']
+            num_stripes = metadata['num_stripes']
+            if start_stripe + num_stripes > len(layout.p_disks):
+                layout.p_disks.extend(bytes(start_stripe + num_stripes - len(layout.p_disks)))
+            layout.p_disks[start_stripe:start_stripe + num_stripes] = layout.rotation(num_stripes)
+        return layout
+
+    def rotation(self, num_stripes):
+        """Returns the P disks of a file with num_stripes stripes, starting from its first stripe."""
+        n = self.num_disk
+        return bytes((n - 2 - stripe_index) % n for stripe_index in range(num_stripes))
+
+    def extend(self, num_stripes):
+        """Appends the stripes of a new file and returns the index of its first stripe."""
+        start_stripe = len(self.p_disks)
+        self.p_disks.extend(self.rotation(num_stripes))
+        return start_stripe
+
+    def assign(self, start_stripe, num_stripes):
+        """Lays out a file at an existing stripe range, e.g. a reused free extent or the target of a compaction move."""
+        self.p_disks[start_stripe:start_stripe + num_stripes] = self.rotation(num_stripes)
+
+    def __len__(self):
+        return len(self.p_disks)
+
+    def p_disk(self, stripe_index):
+        return self.p_disks[stripe_index]
+
+    def q_disk(self, stripe_index):
+        return (self.p_disks[stripe_index] + 1) % self.num_disk
+
+    def is_parity(self, stripe_index, disk_index):
+        p_disk = self.p_disks[stripe_index]
+        return disk_index == p_disk or disk_index == (p_disk + 1) % self.num_disk
+
+    def data_disks(self, stripe_index):
+        """Returns the disks holding data in the stripe, in the order the file's chunks are laid out."""
+        return self.data_disks_by_p[self.p_disks[stripe_index]]
@@ -1,21 +1,77 @@
 import os
 import json
+import time
+import zlib
+import uuid
+import array
+import threading
+import functools
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy the array runs on the stdlib kernel
+    np = None
 from src.raid6.GaloisField import GF
-import src.cloud_implementation.api_client as client
+from src.raid6.ParityLayout import ParityLayout
+from src.raid6.Stats import Stats
+from src.raid6.StripeCache import StripeCache
+from src.raid6.ReadAhead import ReadAhead
+from src.raid6.DiskBackend import DiskBackend, FileDisks, MmapDisks, MemoryDisks, HttpDisks
+
+
+def synchronized(method):
+    """Runs the method while holding the RAID's lock, so background compaction never interleaves with it."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def profiled(method):
+    """Runs the operation under the cProfile hook of the RAID's stats, which only profiles if a profile_dir is set."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.stats.profile(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Per-chunk CRC32s, stored next to metadata.json
+CHECKSUM_FILE = 'checksums.bin'
+
+
+@contextlib.contextmanager
+def _replacing(path, mode):
+    """Opens a file next to path that replaces it once it is written, so a crash leaves either the old or the new file."""
+    with open(f'{path}.tmp', mode) as f:
+        yield f
+    os.replace(f'{path}.tmp', path)
+
 
 class RAID6:
-    def __init__(self, chunk_size=0, num_disk=0, is_local=True, dir=None, existing_dir=None):
-        """Initializes the RAID 6 environment or loads an existing configuration."""
+    def __init__(self, chunk_size=0, num_disk=0, is_local=True, dir=None, existing_dir=None, max_inflight_stripes=1024, use_mmap=False, workers=1, segment_stripes=256, backend=None, profile_dir=None, kernel=None, auto_rebuild=False, cache_bytes=0, readahead_stripes=None):
+        """Initializes the RAID 6 environment or loads an existing configuration.
+
+        An existing array's disks are health checked when it is opened; failed disks are read in degraded mode, or rebuilt
+        right away with auto_rebuild=True. With cache_bytes set, up to that many bytes of decoded stripes are kept in memory
+        for repeated reads. Sequential file reads prefetch up to readahead_stripes stripes, by default max_inflight_stripes.
+        """
         self.chunk_size = chunk_size
         self.num_disk = num_disk
         self.dir = dir
         self.existing_dir = existing_dir
-        self.gf = GF()
+        # 'numpy' or 'stdlib' block kernels, NumPy whenever it is installed unless chosen otherwise
+        self.kernel = kernel or ('numpy' if np is not None else 'stdlib')
+        if self.kernel not in ('numpy', 'stdlib'):
+            raise ValueError(f"Unknown kernel {kernel}")
+        self.gf = GF(use_numpy=self.kernel == 'numpy')
         self.test_directory = dir
-        self.matrix = []
         self.disk_data = None
-        self.P_loc = []
-        self.Q_loc = []
+        self.layout = ParityLayout(num_disk)
         self.total_stripes = 0
         self.file_metadata = {}
         self.old_files = []
@@ -23,13 +79,56 @@ class RAID6:
         self.num_data_disk = num_disk - 2
         self.files_dir = os.path.join(self.dir, 'files')
         self.disks_dir = os.path.join(self.dir, 'disks')
-        self.file_dict = {i: "" for i in range(num_disk)}
+        self.file_dict = {str(i): [] for i in range(num_disk)}
         self.is_local = is_local
+        self.max_inflight_stripes = max_inflight_stripes
+        self.use_mmap = use_mmap
+        self.workers = workers
+        self.segment_stripes = segment_stripes
+        self.failed_disks = set()
+        self.free_extents = []
+        self._decoders = {}
+        # The compaction move in progress, see compact()
+        self._move = None
+        # CRC32 of every chunk, stripe-major (stripe_index * num_disk + disk_index); None for arrays created without them
+        self.checksums = array.array('I')
+        # Every disk carries a label with the array id and the generation of the last metadata it saw, see check_disks
+        self.array_id = uuid.uuid4().hex
+        self.generation = 0
+        self.disk_labels = {}
+        # Time and bytes spent per phase, see Stats.PHASES
+        self.stats = Stats(profile_dir)
+        # Decoded data of recently read stripes, including the chunks reconstructed in degraded mode
+        self.cache = StripeCache(cache_bytes)
+        self._lock = threading.RLock()
         print(self.file_dict)
         if existing_dir and os.path.exists(existing_dir):
             self._load_metadata(existing_dir)
         elif chunk_size is None or num_disk is None:
             raise ValueError("chunk_size and num_disk are not provided")
+        self.backend = self._open_backend(backend)
+        # All disks are read concurrently, and ahead of sequential file reads
+        self.readahead = ReadAhead(self._read_disk_range, self.num_disk, self.chunk_size,
+                                   max_inflight_stripes if readahead_stripes is None else readahead_stripes)
+        if existing_dir and os.path.exists(existing_dir):
+            self._handle_failed_disks(self.check_disks(), auto_rebuild)
+
+
+    def _open_backend(self, backend):
+        """Returns the storage of the disk images: a DiskBackend or one of 'file', 'mmap', 'memory' and 'http'."""
+        if isinstance(backend, DiskBackend):
+            return backend
+        if backend is None:
+            backend = ('mmap' if self.use_mmap else 'file') if self.is_local else 'http'
+        if backend == 'file':
+            return FileDisks(self.disks_dir)
+        if backend == 'mmap':
+            return MmapDisks(self.disks_dir)
+        if backend == 'memory':
+            return MemoryDisks()
+        if backend == 'http':
+            return HttpDisks(self.chunk_size, self.segment_stripes, self.file_dict, self.total_stripes, self.disk_labels)
+        raise ValueError(f"Unknown disk backend {backend}")
 
     def _load_metadata(self, existing_dir):
         """Loads RAID system configuration from metadata."""
@@ -46,12 +145,23 @@ class RAID6:
                 self.old_files = raid.get('old_files', [])
                 self.file_dict = raid.get('file_ids', {})
                 self.is_local = raid.get('is_local', True)
+                self.free_extents = raid.get('free_extents', [])
+                self.layout = self.recalculate_parity_locations()
+                self.checksums = self._load_checksums(existing_dir) if raid.get('checksum') == 'crc32' else None
+                # Arrays from before disk labels have no generation, their labels are written by the next save
+                self.array_id = raid.get('array_id', self.array_id)
+                self.generation = raid.get('generation')
+                self.disk_labels = raid.get('disk_labels', {})
         else:
             raise FileNotFoundError(f"No metadata found in {existing_dir}")
 
 
     def save_metadata(self):
         """Saves the entire RAID structure to a metadata file."""
+        # The labels are written first and the ones they replace on the disk server are kept until the new metadata is in
+        # place, so after a crash the labels the metadata refers to are never older than it
+        self.generation = (self.generation or 0) + 1
+        self._write_disk_labels()
         metadata = {
             'chunk_size': self.chunk_size,
             'num_disk': self.num_disk,
@@ -59,30 +169,168 @@ class RAID6:
             'total_stripes': self.total_stripes,
             'old_files': self.old_files,
             'file_ids': self.file_dict,
-            'is_local': self.is_local
+            'is_local': self.is_local,
+            'free_extents': self.free_extents,
+            'array_id': self.array_id,
+            'generation': self.generation,
+            'disk_labels': self.disk_labels
         }
+        if self.checksums is not None:
+            # The checksums are kept next to the metadata in a binary file instead of the JSON
+            metadata['checksum'] = 'crc32'
+            with _replacing(os.path.join(self.test_directory, CHECKSUM_FILE), 'wb') as f:
+                self.checksums.tofile(f)
         metadata_file = os.path.join(self.test_directory, 'metadata.json')
-        with open(metadata_file, 'w') as f:
+        with _replacing(metadata_file, 'w') as f:
             json.dump(metadata, f)
+        # Segments and labels replaced on the disk server are deleted once the metadata no longer refers to them
+        self.backend.delete_replaced()
+
+
+    def _write_disk_labels(self):
+        """Writes the current generation to the label of every disk that is present and not failed."""
+        def write_label(disk_index):
+            if disk_index not in self.failed_disks and (self.backend.exists(disk_index) or not self.total_stripes):
+                label = {'array_id': self.array_id, 'disk': disk_index, 'generation': self.generation}
+                self.backend.write_label(disk_index, json.dumps(label).encode())
+
+        with ThreadPoolExecutor(max_workers=self.num_disk) as executor:
+            list(executor.map(write_label, range(self.num_disk)))
+
+
+    def check_disks(self):
+        """Returns the disks that are missing, shorter than total_stripes stripes or whose label does not match the metadata.
+
+        Only the size and the label of each disk are looked at, so the check costs one small read per disk. A disk whose
+        label has an older generation missed writes, e.g. because it was offline, and is treated as failed.
+        """
+        disk_size = self.total_stripes * self.chunk_size
+
+        def check_disk(disk_index):
+            size = self.backend.size(disk_index)
+            if size is None:
+                if self.total_stripes:
+                    return 'missing'
+            elif size < disk_size:
+                # A larger image is fine, the stripes past total_stripes are cut off by the next append
+                return f'has {size} instead of {disk_size} bytes'
+            if self.generation is None:
+                return None
+            label = self.backend.read_label(disk_index)
+            try:
+                label = json.loads(label)
+            except (TypeError, ValueError):
+                return 'has no valid label'
+            if label.get('array_id') != self.array_id or label.get('disk') != disk_index:
+                return 'belongs to another array or position'
+            if label.get('generation', -1) < self.generation:
+                return f"is stale (generation {label.get('generation')} instead of {self.generation})"
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.num_disk) as executor, self.stats.phase(self._disk_phase('read')):
+            problems = list(executor.map(check_disk, range(self.num_disk)))
+
+        failed_disks = []
+        for disk_index, problem in enumerate(problems):
+            if problem is not None:
+                print(f"Disk {disk_index} {problem}")
+                failed_disks.append(disk_index)
+        return failed_disks
+
+
+    def _handle_failed_disks(self, failed_disks, auto_rebuild):
+        """Puts the array in degraded mode for the failed disks, or rebuilds them if auto_rebuild is set."""
+        if not failed_disks:
+            return
+        self.failed_disks.update(failed_disks)
+        if len(self.failed_disks) > 2:
+            print(f"Disks {sorted(self.failed_disks)} failed, RAID 6 can only recover up to two")
+        elif auto_rebuild:
+            print(f"Rebuilding failed disks {sorted(self.failed_disks)}")
+            self.rebuild_data(sorted(self.failed_disks), recover_files=False)
+        else:
+            print(f"Disks {sorted(self.failed_disks)} failed, running in degraded mode")
+
+
+    def _write_checksums(self, indices):
+        """Overwrites the given entries of the checksum file in place, so small updates do not rewrite all checksums."""
+        itemsize = self.checksums.itemsize
+        with open(os.path.join(self.test_directory, CHECKSUM_FILE), 'r+b') as f:
+            for index in sorted(indices):
+                f.seek(index * itemsize)
+                f.write(self.checksums[index:index + 1].tobytes())
+
+
+    def _load_checksums(self, existing_dir):
+        checksum_file = os.path.join(existing_dir, CHECKSUM_FILE)
+        if not os.path.exists(checksum_file):
+            print(f"No checksums found in {existing_dir}, run scrub() to create them")
+            return None
+        checksums = array.array('I')
+        with open(checksum_file, 'rb') as f:
+            checksums.frombytes(f.read())
+        return checksums
 
 
     def read_data(self, filename, mode='rb'):
         with open(filename, mode) as f:
-            return list(f.read())
-
-    
-    def update_file_metadata(self):
-        current_stripe = 0
-        for file, metadata in self.file_metadata.items():
-            num_stripes = metadata['num_stripes']
-            self.file_metadata[file]['start_stripe'] = current_stripe
-            self.file_metadata[file]['end_stripe'] = current_stripe + num_stripes - 1
-            current_stripe += num_stripes
-        return self.file_metadata
+            return f.read()
 
     
     def compute_parity(self, matrix):
         """Computes the P and Q parity for the distributed data in the matrix."""
+        if self.kernel == 'stdlib':
+            return self._compute_parity_stdlib(matrix)
+        stripes = self._stripes_to_array(matrix)
+        return self._parity_kernel(stripes)
+
+
+    def _compute_parity_stdlib(self, matrix):
+        """Computes P and Q as one bytes object per stripe, multiplying and XORing whole chunks at a time."""
+        P_parity = []
+        Q_parity = []
+        for stripe_index in range(len(matrix)):
+            P = bytearray(self.chunk_size)
+            Q = bytearray(self.chunk_size)
+            for disk_index in self.layout.data_disks(stripe_index):
+                data_val = matrix[stripe_index][disk_index]
+                if data_val is not None and len(data_val) == self.chunk_size:
+                    self.gf.mul_add_into(P, data_val, 1)
+                    self.gf.mul_add_into(Q, data_val, self.gf.exp(disk_index))
+            P_parity.append(bytes(P))
+            Q_parity.append(bytes(Q))
+        return P_parity, Q_parity
+
+
+    def _stripes_to_array(self, matrix):
+        """Packs the data chunks of the matrix into a (stripes, disks, chunk_size) uint8 array with zeroed parity cells."""
+        num_stripes = len(matrix)
+        stripes = np.zeros((num_stripes, self.num_disk, self.chunk_size), dtype=np.uint8)
+
+        for stripe_index in range(num_stripes):
+            for disk_index in self.layout.data_disks(stripe_index):
+                data_val = matrix[stripe_index][disk_index]
+                if data_val is not None and len(data_val) == self.chunk_size:
+                    stripes[stripe_index, disk_index] = np.frombuffer(bytes(data_val), dtype=np.uint8)
+
+        return stripes
+
+
+    def _parity_kernel(self, stripes):
+        """Computes P and Q for a (stripes, disks, chunk_size) uint8 array whose parity cells are zero."""
+        # P is a plain XOR reduction over the disks of each stripe
+        P_parity = np.bitwise_xor.reduce(stripes, axis=1)
+
+        # Q adds g^disk_index * D for every disk, one table gather per disk
+        Q_parity = np.zeros_like(P_parity)
+        for disk_index in range(self.num_disk):
+            self.gf.mul_add_into(Q_parity, stripes[:, disk_index], self.gf.exp(disk_index))
+
+        return P_parity, Q_parity
+
+
+    def compute_parity_reference(self, matrix):
+        """Pure Python byte-by-byte P and Q computation, kept as a reference for the vectorized kernel."""
         # Initialize parity arrays
         num_stripes = len(matrix)
         P_parity = [[0] * self.chunk_size for _ in range(num_stripes)]
@@ -90,207 +338,124 @@ class RAID6:
 
         # Compute P and Q parity for each stripe
         for stripe_index in range(num_stripes):
-            for disk_index in range(self.num_disk):
-                # Skip the P and Q locations during data processing
-                if (stripe_index, disk_index) not in self.P_loc and (stripe_index, disk_index) not in self.Q_loc:
-                    data_val = matrix[stripe_index][disk_index]
-                    if data_val is not None and len(data_val) == self.chunk_size:
-                        for i in range(self.chunk_size):
-                            P_parity[stripe_index][i] ^= data_val[i]
-                            Q_parity[stripe_index][i] ^= self.gf.mul(data_val[i], self.gf.exp(disk_index))
+            # Skip the P and Q locations during data processing
+            for disk_index in self.layout.data_disks(stripe_index):
+                data_val = matrix[stripe_index][disk_index]
+                if data_val is not None and len(data_val) == self.chunk_size:
+                    for i in range(self.chunk_size):
+                        P_parity[stripe_index][i] ^= data_val[i]
+                        Q_parity[stripe_index][i] ^= self.gf.mul(data_val[i], self.gf.exp(disk_index))
 
         return P_parity, Q_parity
 
 
     def recalculate_parity_locations(self):
-        """Recalculate P and Q locations after the matrix is compacted due to file deletion."""
-        P_loc = []
-        Q_loc = []
-
-        for filename, metadata in self.file_metadata.items():
-            start_stripe = metadata['start_stripe']
-            end_stripe = metadata['end_stripe']
-            num_stripes = metadata['num_stripes']
-
-            # Recalculate parity locations for each stripe
-            for stripe_index in range(self.total_stripes):
-                p_disk = (self.num_disk - 2 - stripe_index) % self.num_disk
-                q_disk = (self.num_disk - 1 - stripe_index) % self.num_disk
-                P_loc.append((start_stripe + stripe_index, p_disk))
-                Q_loc.append((start_stripe + stripe_index, q_disk))
-
-        return P_loc, Q_loc
+        """Recalculate the P and Q layout from the file metadata, e.g. after the matrix is compacted due to file deletion."""
+        return ParityLayout.from_file_metadata(self.num_disk, self.file_metadata, self.total_stripes)
 
 
+    @profiled
+    @synchronized
     def load_existing_data(self):
         """Reconstructs data from existing RAID configuration for multiple files, supporting P and Q parity recomputation."""
-    
-        # Rebuild matrix from disk files
-        reloaded_matrix = [[None for _ in range(self.num_disk)] for _ in range(self.total_stripes)]
-        for disk_index in range(self.num_disk):
-            if self.is_local:
-                disk_file = os.path.join(self.disks_dir, f'disk_{disk_index}')
-                if os.path.exists(disk_file):
-                    with open(disk_file, 'rb') as f:
-                        disk_content = f.read()
-            else:
-                file_id = self.file_dict[str(disk_index)]
-                disk_content = client.get_disk_data(disk_index, file_id)
-            
-            if disk_content:
-            # Split disk data into chunks
-                disk_content = list(disk_content)
-                disk_chunks = [disk_content[i:i + self.chunk_size] for i in range(0, len(disk_content), self.chunk_size)]
-
-                # Rebuild matrix for this disk
-                for stripe_index in range(self.total_stripes):
-                    if stripe_index < len(disk_chunks):
-                        reloaded_matrix[stripe_index][disk_index] = disk_chunks[stripe_index]
-                    else:
-                        reloaded_matrix[stripe_index][disk_index] = [0] * self.chunk_size  # Pad remaining stripes
-
-        # Recalculate P_loc and Q_loc based on the rebuild
-        reloaded_P_loc = []
-        reloaded_Q_loc = []
-        current_stripe_index = 0
-    
-        # Process each file in the file_metadata
-        for filename, metadata in self.file_metadata.items():
 
-    
-            P_loc_file = []
-            Q_loc_file = []
-    
-            # Determine P and Q parities positions in matrix
-            num_stripes = metadata['num_stripes']
-            for stripe_index in range(num_stripes):
-                p_disk = (self.num_disk - 2 - stripe_index) % self.num_disk
-                q_disk = (self.num_disk - 1 - stripe_index) % self.num_disk
-                P_loc_file.append((current_stripe_index + stripe_index, p_disk))  
-                Q_loc_file.append((current_stripe_index + stripe_index, q_disk))  
-    
-            # Append file-specific P_loc and Q_loc to the global lists
-            reloaded_P_loc.extend(P_loc_file)
-            reloaded_Q_loc.extend(Q_loc_file)
-    
-            current_stripe_index += num_stripes
-    
-        
-        # Initialize lists to accumulate data for each disk
-        disk_data = [bytearray() for _ in range(self.num_disk)]
-        
-        # Save data for each disk
-        for i in range(self.num_disk):
-            for stripe_index in range(len(reloaded_matrix)):
-                # Always extend the disk data, even if the stripe is zero-padded
-                disk_data[i].extend(reloaded_matrix[stripe_index][i])
-    
+        # Address every disk image through zero-copy views instead of splitting it into chunk lists
+        self.disk_data = self._open_disk_views()
+        for disk_index, view in enumerate(self.disk_data):
+            if view is None and disk_index not in self.failed_disks:
+                print(f"Disk {disk_index} is missing, reading in degraded mode")
+                self.failed_disks.add(disk_index)
+
+        # Recalculate the P and Q layout based on the rebuild
+        self.layout = self.recalculate_parity_locations()
+
         # Save individual pre files for each format
-        for filename, metadata in self.file_metadata.items():
-            start_stripe = metadata['start_stripe']
-            end_stripe = metadata['end_stripe']
-            pre_data = bytearray()
-    
-            # Accumulate data for the file from corresponding stripes
-            for stripe_index in range(start_stripe, end_stripe + 1):
-                for disk_index in range(self.num_disk):
-                    if (stripe_index, disk_index) not in reloaded_P_loc and (stripe_index, disk_index) not in reloaded_Q_loc:
-                        if reloaded_matrix[stripe_index][disk_index] != [0] * self.chunk_size:
-                            pre_data.extend(reloaded_matrix[stripe_index][disk_index])
-    
-            # Save accumulated non-parity data as pre.<format>
-            reload_dir = os.path.join(self.dir, 'Reloaded_Initial_distributed_files')
+        reload_dir = os.path.join(self.dir, 'Reloaded_Initial_distributed_files')
+        for filename in self.file_metadata:
             pre_filename = f'pre_reloaded.{filename}'
             print(f'created {pre_filename}')
             with open(os.path.join(reload_dir, pre_filename), 'wb') as f:
-                f.write(pre_data)
+                # Every chunk is verified, and repaired or reconstructed from its stripe where needed
+                for data in self.iter_file(filename):
+                    self._write_output(f, data)
 
-                
-        self.matrix = reloaded_matrix
-        self.P_loc = reloaded_P_loc
-        self.Q_loc = reloaded_Q_loc
-        self.disk_data = disk_data
+        return self.disk_data
 
-        return reloaded_matrix
 
+    def _open_disk_views(self):
+        """Returns a flat memoryview per disk image in which stripe_index * chunk_size addresses a chunk, or None for a missing disk."""
+        disk_size = self.total_stripes * self.chunk_size
+        # All disks are read at once, which overlaps the transfers of remote disks
+        def view(disk_index):
+            # Failed disks, e.g. stale ones found by check_disks, are not used even if they are present
+            return None if disk_index in self.failed_disks else self.backend.view(disk_index, disk_size)
+
+        with ThreadPoolExecutor(max_workers=self.num_disk) as executor, self.stats.phase(self._disk_phase('read'), disk_size * self.num_disk):
+            disk_contents = list(executor.map(view, range(self.num_disk)))
+
+        views = []
+        for disk_content in disk_contents:
+            if disk_content is None:
+                views.append(None)
+                continue
+
+            view = memoryview(disk_content)
+            if len(view) < disk_size:
+                # Pad remaining stripes
+                padded = bytearray(disk_size)
+                padded[:len(view)] = view
+                view = memoryview(padded)
+            views.append(view[:disk_size])
+
+        return views
 
-    def distribute_data(self, existing_dir=None):
-        """Distributes data across the data disks for multiple formats, creating separate matrices for each file and then merging them."""
 
-        # Initialize lists to accumulate data for each disk
-        disk_data = [bytearray() for _ in range(self.num_disk)]
+    def chunk_view(self, stripe_index, disk_index):
+        """Returns a zero-copy view of one chunk of the currently opened disk images."""
+        offset = stripe_index * self.chunk_size
+        return self.disk_data[disk_index][offset:offset + self.chunk_size]
 
+
+    @profiled
+    @synchronized
+    def distribute_data(self, existing_dir=None):
+        """Distributes data across the data disks for multiple formats, streaming each new file to the disks stripe block by stripe block."""
         files = os.listdir(self.files_dir)
 
         new_files_added = [item for item in files if item not in self.old_files]
         new_files_deleted = [item for item in self.old_files if item not in files]
         
         if existing_dir:
-            
-            self.load_existing_data()
-            all_matrices = self.matrix
-            
-            #if files added
-            if len(new_files_added) > 0:
-                print('adding new files')
-                current_stripe_index = len(all_matrices)
-            #if files deleted
-            elif len(new_files_deleted) > 0:
+            #if files deleted, their stripes are only marked as free until compact() relocates the remaining files
+            if len(new_files_deleted) > 0:
                 print('Deleting files')
-                print(f'total: {self.total_stripes}')
                 for deleted_file in new_files_deleted:
-                    # Find the stripe range of the deleted file from metadata
                     if deleted_file in self.file_metadata:
-                        start_stripe = self.file_metadata[deleted_file]['start_stripe']
-                        end_stripe = self.file_metadata[deleted_file]['end_stripe']
-                        num_stripes = self.file_metadata[deleted_file]['num_stripes']
-
-                        # Remove corresponding stripes from the matrix
-                        for stripe_index in range(start_stripe, end_stripe + 1):
-                            for disk_index in range(self.num_disk):
-                                all_matrices[stripe_index][disk_index] = None
-
-                        # Remove the deleted file's metadata
-                        del self.file_metadata[deleted_file]
-
-                        self.total_stripes -= num_stripes
-
-                # After deletion, recompute the matrix by removing the empty rows
-                all_matrices = [row for row in all_matrices if any(chunk is not None for chunk in row)]
+                        self.free_file(deleted_file)
 
-                # Reset stripe index and recalculate P/Q locations
-                current_stripe_index = len(all_matrices)
-                self.old_files = files
-                self.matrix = all_matrices
-                self.update_file_metadata()
-                self.P_loc, self.Q_loc = self.recalculate_parity_locations()
-                # Save data for each disk
-                for i in range(self.num_disk):
-                    for stripe_index in range(len(all_matrices)):
-                        disk_data[i].extend(all_matrices[stripe_index][i])
-
-                    if self.is_local:
-                        with open(os.path.join(self.disks_dir, f'disk_{i}'), 'wb') as f:
-                            f.write(disk_data[i])
-                    else:
-                        file_id = client.upload_to_disk(i, disk_data[i])
-                        self.file_dict[str(i)] = file_id
-                return
-
-            # If files are unchanged
+            #if files added, they reuse free extents or are appended without touching the existing stripes
+            if len(new_files_added) > 0:
+                print('adding new files')
             else:
-                print('no new files')
+                if len(new_files_deleted) == 0:
+                    print('no new files')
                 self.old_files = files
+                self.save_metadata()
                 return
         else:
-            all_matrices = []
-            current_stripe_index = 0
-            self.P_loc = []
-            self.Q_loc = []
-
-
-        # Process each file in the 'files' directory
-        for file_index, filename in enumerate(new_files_added):
+            self.layout = ParityLayout(self.num_disk)
+            self.checksums = array.array('I')
+            # Every disk is written from scratch
+            self.failed_disks.clear()
+            self._invalidate_stripes(0)
+
+        # Open the per-disk outputs; when adding files they continue after the existing stripes and are only opened once a file is appended
+        append = bool(existing_dir)
+        disk_outputs = None if append else self._open_disk_outputs()
+
+        # Stream each new file in the 'files' directory straight to the disks
+        init_dir = os.path.join(self.dir, 'Initial_distributed_files')
+        for filename in new_files_added:
             filepath = os.path.join(self.files_dir, filename)
             print(f'adding {new_files_added}')
             file_extension = filename.split('.')[-1].lower()
@@ -300,282 +465,1066 @@ class RAID6:
                 print(f"Skipping unsupported file format: {filename}")
                 continue
 
-            # Read the original data for this file
-            data = self.read_data(filepath)
-            chunks = [data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)]
-            max_chunks = len(chunks)
+            # Reuse a freed stripe range if one is large enough, otherwise append
+            pre_filename = f'pre_initial_{filename}'
+            start_stripe = self._allocate_stripes(self._num_file_stripes(os.path.getsize(filepath)))
+            with open(os.path.join(init_dir, pre_filename), 'wb') as pre_file:
+                if start_stripe is None:
+                    if disk_outputs is None:
+                        disk_outputs = self._open_disk_outputs(append)
+                    self.encode_file(filepath, filename, disk_outputs, pre_file)
+                else:
+                    self._encode_file_in_place(filepath, filename, start_stripe, pre_file)
+            print(f'created {pre_filename}')
+
+        if disk_outputs is not None:
+            self._close_disk_outputs(disk_outputs)
+
+        self.disk_data = None
+        self.old_files = files
+        self.save_metadata()
+
+
+    def encode_file(self, filepath, filename, disk_outputs, pre_file=None, start_stripe=None):
+        """Encodes one file stripe block by stripe block and writes the chunks and parity to the disk outputs.
+
+        Without start_stripe the stripes are appended to the array, otherwise they are placed at an already reserved range.
+        """
+        file_size = os.path.getsize(filepath)
+        stripe_bytes = self.num_data_disk * self.chunk_size
 
-            # Calculate the number of stripes (rows in the matrix)
-            num_stripes = (max_chunks + self.num_data_disk - 1) // self.num_data_disk
+        # Calculate the number of stripes (rows in the matrix) and reserve them in the layout
+        num_stripes = self._num_file_stripes(file_size)
+        if start_stripe is None:
+            start_stripe = self.layout.extend(num_stripes)
             self.total_stripes += num_stripes
+        else:
+            self.layout.assign(start_stripe, num_stripes)
+        self._invalidate_stripes(start_stripe, start_stripe + num_stripes)
+
+        # Save file metadata with start, end, and number of stripes
+        self.file_metadata[filename] = {
+            'start_stripe': start_stripe,
+            'end_stripe': start_stripe + num_stripes - 1,
+            'num_stripes': num_stripes,
+            'file_size': file_size
+        }
 
-            # Save file metadata with start, end, and number of stripes
-            self.file_metadata[filename] = {
-                'start_stripe': current_stripe_index,
-                'end_stripe': current_stripe_index + num_stripes - 1,
-                'num_stripes': num_stripes
-            }
- 
-            file_matrix = [[bytearray([0] * self.chunk_size) for _ in range(self.num_disk)] for _ in range(num_stripes)]
-
-
-            P_loc_file = []
-            Q_loc_file = []
-
-            # Determine P and Q parities positions in the matrix for this file
-            for stripe_index in range(num_stripes):
-                p_disk = (self.num_disk - 2 - stripe_index) % self.num_disk
-                q_disk = (self.num_disk - 1 - stripe_index) % self.num_disk
-                P_loc_file.append((stripe_index, p_disk))
-                Q_loc_file.append((stripe_index, q_disk))
-
-            # Fill in the data chunks row by row for this file
-            chunk_index = 0
-            for stripe_index in range(num_stripes):
-                for disk_index in range(self.num_disk):
-                    if (stripe_index, disk_index) in P_loc_file or (stripe_index, disk_index) in Q_loc_file:
-                        continue
-                    if chunk_index < max_chunks:
-                        file_matrix[stripe_index][disk_index] = chunks[chunk_index]
-                        while len(file_matrix[stripe_index][disk_index]) < self.chunk_size:
-                            file_matrix[stripe_index][disk_index].append(0)
-                        chunk_index += 1
-                    else:
-                        # Pad with zeros if no data left
-                        file_matrix[stripe_index][disk_index] = [0] * self.chunk_size
-
-            # Store file's P_loc and Q_loc globally
-            self.P_loc.extend([(current_stripe_index + stripe_index, disk) for stripe_index, disk in P_loc_file])
-            self.Q_loc.extend([(current_stripe_index + stripe_index, disk) for stripe_index, disk in Q_loc_file])
-
-            
-            # Append this file's matrix to the overall matrix
-            all_matrices.extend(file_matrix)
-
-            # Update the stripe index for the next file
-            current_stripe_index += num_stripes
-
-        # Compute P and Q parity after merging the matrices
-        P, Q = self.compute_parity(all_matrices)
-
-        # Assign computed P and Q parities to their respective locations in the global matrix
-        for stripe_index in range(self.total_stripes):
-            for disk_index in range(self.num_disk):
-                if (stripe_index, disk_index) in self.P_loc:
-                    all_matrices[stripe_index][disk_index] = P[stripe_index]
-                if (stripe_index, disk_index) in self.Q_loc:
-                    all_matrices[stripe_index][disk_index] = Q[stripe_index]
-
-
-
-        # Save individual pre files for each format based on start and end stripes
-        for filename, metadata in self.file_metadata.items():
-            start_stripe = metadata['start_stripe']
-            end_stripe = metadata['end_stripe']
-            pre_data = bytearray()
-
-            for stripe_index in range(start_stripe, end_stripe + 1):
+        def read_blocks(f):
+            stripe_index = start_stripe
+            while True:
+                start = time.perf_counter()
+                block = f.read(stripe_bytes * self.max_inflight_stripes)
+                self.stats.add('read', time.perf_counter() - start, len(block))
+                if not block:
+                    return
+                if pre_file is not None:
+                    self._write_output(pre_file, block)
+                yield block, stripe_index
+                stripe_index += self._num_file_stripes(len(block))
+
+        def encode_block(block, stripe_index):
+            cells = self._encode_block(block, stripe_index)
+            return cells, stripe_index, self._block_checksums(cells)
+
+        # Blocks of max_inflight_stripes stripes are encoded by up to `workers` threads and written in order
+        with open(filepath, 'rb') as f:
+            for cells, stripe_index, checksums in self._map_blocks(encode_block, read_blocks(f)):
                 for disk_index in range(self.num_disk):
-                    if (stripe_index, disk_index) not in self.P_loc and (stripe_index, disk_index) not in self.Q_loc:
-                        if all_matrices[stripe_index][disk_index] != [0] * self.chunk_size:
-                            pre_data.extend(all_matrices[stripe_index][disk_index])
+                    self._write_output(disk_outputs[disk_index], cells[disk_index])
+                self._set_checksums(stripe_index, checksums)
 
-            
-            pre_filename = f'pre_initial_{filename}'
-            print(f'created {pre_filename}')
-            init_dir = os.path.join(self.dir, 'Initial_distributed_files')
-            with open(os.path.join(init_dir, pre_filename), 'wb') as f:
-                f.write(pre_data)
-        
+        return self.file_metadata[filename]
 
-        self.matrix = all_matrices
 
-        
+    def _write_output(self, output, data):
+        with self.stats.phase('write', len(memoryview(data).cast('B'))):
+            output.write(data)
 
-        self.old_files = files
 
-        # Save data for each disk
-        for i in range(self.num_disk):
-            for stripe_index in range(len(all_matrices)):
-                disk_data[i].extend(all_matrices[stripe_index][i])
+    def _close_output(self, output):
+        # Closing the outputs of a remote backend uploads what was written to them
+        with self.stats.phase(self._disk_phase('write')):
+            output.close()
 
-            if self.is_local:
-                with open(os.path.join(self.disks_dir, f'disk_{i}'), 'wb') as f:
-                    f.write(disk_data[i])
-            else:
-                file_id = client.upload_to_disk(i, disk_data[i])
-                self.file_dict[str(i)] = file_id
 
+    def _disk_phase(self, phase):
+        """Disk reads and writes of a remote backend are counted as network time."""
+        return 'network' if isinstance(self.backend, HttpDisks) else phase
 
-        self.disk_data = disk_data
 
-        return all_matrices, disk_data
+    def _map_blocks(self, function, blocks):
+        """Applies function to each tuple of arguments and yields the results in order, using up to `workers` threads.
 
-    def delete_disk(self, deleted_disks):
-        """Delete specified disks."""
-        for i in deleted_disks:
-            if self.is_local:
-                os.remove(os.path.join(self.disks_dir, f'disk_{i}'))
-            else:
-                file_id = self.file_dict[str(i)]
-                client.delete_file(i, file_id)
-            print(f"Disk {i} was deleted")
+        The NumPy GF kernels release the GIL, so blocks are processed in parallel while at most `workers` of them are in flight.
+        The stdlib kernel holds the GIL, threads would only add overhead, so its blocks are processed one after another.
+        """
+        if self.workers <= 1 or self.kernel == 'stdlib':
+            for args in blocks:
+                yield function(*args)
+            return
 
-        self.matrix = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for args in blocks:
+                pending.append(executor.submit(function, *args))
+                if len(pending) >= self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
 
-    def rebuild_data(self, deleted_disks):
-        """Rebuilds data from the available disks using the matrix to XOR the correct chunks together and writes the reconstructed data back to disk."""
+    def _num_file_stripes(self, file_size):
+        num_chunks = (file_size + self.chunk_size - 1) // self.chunk_size
+        return (num_chunks + self.num_data_disk - 1) // self.num_data_disk
 
-        # Rebuild the matrix from disk files directly
-        self.matrix = [[None for _ in range(self.num_disk)] for _ in range(self.total_stripes)]
-    
+
+    def _encode_file_in_place(self, filepath, filename, start_stripe, pre_file=None):
+        """Encodes one file into a reserved stripe range, overwriting the freed stripes on each disk."""
+        disk_outputs = []
         for disk_index in range(self.num_disk):
+            if disk_index in self.failed_disks or not self.backend.exists(disk_index):
+                disk_outputs.append(open(os.devnull, 'wb'))
+            else:
+                disk_outputs.append(self.backend.writer(disk_index, start_stripe * self.chunk_size))
+        try:
+            self.encode_file(filepath, filename, disk_outputs, pre_file, start_stripe)
+        finally:
+            for output in disk_outputs:
+                self._close_output(output)
+
+
+    def free_file(self, filename):
+        """Deletes a file by returning its stripe range to the free extents; the stripes are only relocated by compact()."""
+        metadata = self.file_metadata.pop(filename)
+        self._invalidate_stripes(metadata['start_stripe'], metadata['start_stripe'] + metadata['num_stripes'])
+        self._release_stripes(metadata['start_stripe'], metadata['num_stripes'])
+
+
+    def _allocate_stripes(self, num_stripes):
+        """Reserves the first free extent that fits num_stripes stripes and returns its start, or None to append instead."""
+        for start_stripe, length in self.free_extents:
+            if num_stripes and length >= num_stripes:
+                self._reserve_stripes(start_stripe, num_stripes)
+                return start_stripe
+        return None
+
+
+    def _reserve_stripes(self, start_stripe, num_stripes):
+        """Removes a stripe range from the free extents."""
+        end_stripe = start_stripe + num_stripes
+        free_extents = []
+        for start, length in self.free_extents:
+            if start < start_stripe:
+                free_extents.append([start, min(length, start_stripe - start)])
+            if start + length > end_stripe:
+                free_extents.append([max(start, end_stripe), start + length - max(start, end_stripe)])
+        self.free_extents = free_extents
+
+
+    def _release_stripes(self, start_stripe, num_stripes):
+        """Adds a stripe range to the free extents, merging neighbours and giving a free tail back to the disks."""
+        free_extents = sorted(self.free_extents + [[start_stripe, num_stripes]])
+        merged = []
+        for start, length in free_extents:
+            if not length:
+                continue
+            if merged and merged[-1][0] + merged[-1][1] >= start:
+                merged[-1][1] = max(merged[-1][1], start + length - merged[-1][0])
+            else:
+                merged.append([start, length])
+
+        if merged and merged[-1][0] + merged[-1][1] >= self.total_stripes:
+            self.total_stripes = merged.pop()[0]
+            del self.layout.p_disks[self.total_stripes:]
+            if self.checksums is not None:
+                del self.checksums[self.total_stripes * self.num_disk:]
+            self._invalidate_stripes(self.total_stripes)
+            self._truncate_disks()
+        self.free_extents = merged
+
+
+    def _invalidate_stripes(self, start_stripe, end_stripe=None):
+        """Drops the cached and prefetched data of stripes that are about to be written, from start_stripe on if end_stripe is None.
+
+        A compaction move in progress copies the written stripes of its file again, and is given up if its target is written.
+        """
+        self.cache.invalidate(start_stripe, end_stripe)
+        # Prefetched ranges are few, so they are all dropped, which also waits for prefetches still reading the disks
+        self.readahead.invalidate()
+        move = self._move
+        if move is None:
+            return
+        if start_stripe < move['target'] + move['num_stripes'] and (end_stripe is None or end_stripe > move['target']):
+            self._move = None
+        elif start_stripe < move['source'] + move['copied'] and (end_stripe is None or end_stripe > move['source']):
+            move['copied'] = max(start_stripe - move['source'], 0)
+
+
+    def _truncate_disks(self):
+        """Cuts every disk back to total_stripes stripes."""
+        # Views of memory mapped disks must not reach into the cut off pages
+        self.disk_data = None
+        for disk_index in range(self.num_disk):
+            self.backend.truncate(disk_index, self.total_stripes * self.chunk_size)
+
+
+    @profiled
+    def compact(self, max_stripes=None, throttle=0):
+        """Relocates live files over the free extents, copying them in batches of max_inflight_stripes stripes.
+
+        A file is copied to a range that does not overlap it and stays readable at its old place until the copy is complete,
+        so a crash never leaves it half moved. The lock is only held for one batch at a time, and a write to a stripe that
+        was already copied rewinds the copy. Stops once max_stripes stripes were copied, the next call resumes the move,
+        and sleeps throttle seconds after every batch. Returns True when no free extents are left.
+        """
+        moved = 0
+        while True:
+            with self._lock:
+                if self._move is None:
+                    self._move = self._plan_move()
+                    if self._move is None:
+                        return True
+                if max_stripes is not None and moved >= max_stripes:
+                    return False
+                moved += self._move_batch()
+            if throttle:
+                time.sleep(throttle)
+
+
+    def compact_in_background(self, max_stripes=None, throttle=0.01):
+        """Runs compact() on a daemon thread and returns the thread."""
+        thread = threading.Thread(target=self.compact, kwargs={'max_stripes': max_stripes, 'throttle': throttle}, daemon=True)
+        thread.start()
+        return thread
+
+
+    def _plan_move(self):
+        """Picks the first file behind the first free extent and where it goes, or returns None if nothing is left to move.
+
+        The file goes down into the free extent if it fits there, otherwise behind the last stripe, which grows the free
+        extent by the file's old range so that the files after it fit.
+        """
+        if not self.free_extents:
+            return None
+        first_free, length = self.free_extents[0]
+        candidates = [(metadata['start_stripe'], filename) for filename, metadata in self.file_metadata.items() if metadata['start_stripe'] > first_free]
+        if not candidates:
+            return None
+        source, filename = min(candidates)
+        metadata = self.file_metadata[filename]
+        target = first_free if length >= metadata['num_stripes'] else self.total_stripes
+        return {'metadata': metadata, 'source': source, 'target': target, 'num_stripes': metadata['num_stripes'], 'copied': 0}
+
+
+    def _move_batch(self):
+        """Copies the next batch of stripes of the planned move, or switches the file over once all are copied; returns the stripes copied."""
+        move = self._move
+        if move['metadata'] not in self.file_metadata.values() or move['metadata']['start_stripe'] != move['source']:
+            # The file was deleted since the move was planned
+            self._move = None
+            return 0
+        if move['copied'] == move['num_stripes']:
+            self._finish_move()
+            return 0
+
+        offset = move['copied']
+        num_stripes = min(self.max_inflight_stripes, move['num_stripes'] - offset)
+        columns = self._read_columns(move['source'] + offset, num_stripes)
+        for disk_index in range(self.num_disk):
+            if disk_index not in self.failed_disks:
+                self._write_disk_at(disk_index, [((move['target'] + offset) * self.chunk_size, bytes(columns[disk_index]))])
+        move['copied'] = offset + num_stripes
+        if isinstance(self.backend, HttpDisks):
+            # The copy may replace segments that also hold live stripes, which are recorded in the metadata
+            self.save_metadata()
+        return num_stripes
+
+
+    def _finish_move(self):
+        """Points the file of a completely copied move at its new range and frees the old one."""
+        move = self._move
+        self._move = None
+        metadata, source, target, num_stripes = move['metadata'], move['source'], move['target'], move['num_stripes']
+        self._invalidate_stripes(source, source + num_stripes)
+
+        if target == self.total_stripes:
+            self.layout.extend(num_stripes)
+            self.total_stripes += num_stripes
+        else:
+            self._reserve_stripes(target, num_stripes)
+            self.layout.assign(target, num_stripes)
+        if self.checksums is not None:
+            self._set_checksums(target, self.checksums[source * self.num_disk:(source + num_stripes) * self.num_disk])
+        metadata['start_stripe'] = target
+        metadata['end_stripe'] = target + num_stripes - 1
+        self._release_stripes(source, num_stripes)
+        self.save_metadata()
 
-            if self.is_local:
-                disk_file = os.path.join(self.disks_dir, f'disk_{disk_index}')
-                if os.path.exists(disk_file):
-                    with open(disk_file, 'rb') as f:
-                        disk_content = list(f.read())
+
+    def _encode_block(self, block, start_stripe):
+        """Lays out a block of file data starting at start_stripe and returns a (disks, stripes, chunk_size) array including P and Q."""
+        if self.kernel == 'stdlib':
+            return self._encode_block_stdlib(block, start_stripe)
+        with self.stats.phase('stripe', len(block)):
+            num_stripes = (len(block) + self.num_data_disk * self.chunk_size - 1) // (self.num_data_disk * self.chunk_size)
+            data = np.zeros(num_stripes * self.num_data_disk * self.chunk_size, dtype=np.uint8)
+            data[:len(block)] = np.frombuffer(block, dtype=np.uint8)
+            data = data.reshape(num_stripes, self.num_data_disk, self.chunk_size)
+
+            # Disk-major storage so each disk's output is contiguous; the transposed view is stripe-major
+            cells = np.zeros((self.num_disk, num_stripes, self.chunk_size), dtype=np.uint8)
+            stripes = cells.transpose(1, 0, 2)
+            rows = np.arange(num_stripes)
+
+            p_disks, data_disks = self._block_roles(start_stripe, num_stripes)
+            stripes[rows[:, None], data_disks] = data
+
+        with self.stats.phase('encode', len(block)):
+            P, Q = self._parity_kernel(stripes)
+            stripes[rows, p_disks] = P
+            stripes[rows, (p_disks + 1) % self.num_disk] = Q
+
+        return cells
+
+
+    def _encode_block_stdlib(self, block, start_stripe):
+        """Same as _encode_block, but returns one bytearray per disk and only uses whole-chunk stdlib operations."""
+        stripe_bytes = self.num_data_disk * self.chunk_size
+        num_stripes = (len(block) + stripe_bytes - 1) // stripe_bytes
+        with self.stats.phase('stripe', len(block)):
+            data = memoryview(bytes(block) + bytes(num_stripes * stripe_bytes - len(block)))
+            columns = [bytearray(num_stripes * self.chunk_size) for _ in range(self.num_disk)]
+            p_disks = self.layout.p_disks[start_stripe:start_stripe + num_stripes]
+            for stripe_index, p_disk in enumerate(p_disks):
+                cell = stripe_index * self.chunk_size
+                for k, disk_index in enumerate(self.layout.data_disks_by_p[p_disk]):
+                    chunk = stripe_index * stripe_bytes + k * self.chunk_size
+                    columns[disk_index][cell:cell + self.chunk_size] = data[chunk:chunk + self.chunk_size]
+
+        with self.stats.phase('encode', len(block)):
+            # The parity cells are still zero, so whole columns can be combined: P = XOR of all, Q = XOR of g^disk_index * column
+            P = self.gf.linear_combination(columns, [1] * self.num_disk)
+            Q = self.gf.linear_combination(columns, [self.gf.exp(disk_index) for disk_index in range(self.num_disk)])
+            for stripe_index, p_disk in enumerate(p_disks):
+                cell = stripe_index * self.chunk_size
+                columns[p_disk][cell:cell + self.chunk_size] = P[cell:cell + self.chunk_size]
+                columns[(p_disk + 1) % self.num_disk][cell:cell + self.chunk_size] = Q[cell:cell + self.chunk_size]
+
+        return columns
+
+
+    def _block_roles(self, start_stripe, num_stripes):
+        """Returns the P disk and the data disks of each stripe in a range as index arrays."""
+        p_disks = np.frombuffer(bytes(self.layout.p_disks[start_stripe:start_stripe + num_stripes]), dtype=np.uint8)
+        data_disks = np.array(self.layout.data_disks_by_p, dtype=np.intp).reshape(self.num_disk, self.num_data_disk)[p_disks]
+        return p_disks, data_disks
+
+
+    @profiled
+    def read_file(self, filename):
+        """Returns the content of one stored file, reading only that file's stripes."""
+        return b''.join(self.iter_file(filename))
+
+
+    def iter_file(self, filename):
+        """Yields the content of one stored file in blocks of at most max_inflight_stripes stripes."""
+        remaining = self._get_file_metadata(filename).get('file_size')
+        zero_chunk = bytes(self.chunk_size)
+
+        # The file's position is looked up again for every block since compaction may move it in between
+        offset = 0
+        while True:
+            with self._lock:
+                metadata = self._get_file_metadata(filename)
+                if offset >= metadata['num_stripes']:
+                    break
+                num_stripes = min(self.max_inflight_stripes, metadata['num_stripes'] - offset)
+                data = self._read_stripe_data(metadata['start_stripe'] + offset, num_stripes)
+            offset += num_stripes
+
+            if remaining is None:
+                # Older metadata has no file size, so only the zero padding chunks can be dropped
+                yield b''.join(chunk for chunk in (data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)) if chunk != zero_chunk)
             else:
-                file_id = self.file_dict[str(disk_index)]
-                disk_content = client.get_disk_data(disk_index, file_id)
-                
-            if disk_content:
-                # Split the disk data into chunks of size chunk_size
-                disk_content = list(disk_content)
-                disk_chunks = [disk_content[i:i + self.chunk_size] for i in range(0, len(disk_content), self.chunk_size)]
-            
-                # Rebuild the matrix for this disk
-                for stripe_index in range(self.total_stripes):
-                    if stripe_index < len(disk_chunks):
-                        self.matrix[stripe_index][disk_index] = disk_chunks[stripe_index]
-                    else:
-                        # Pad remaining stripes
-                        self.matrix[stripe_index][disk_index] = [0] * self.chunk_size
+                yield data[:remaining]
+                remaining -= len(data)
+                if remaining <= 0:
+                    break
+
+
+    @profiled
+    @synchronized
+    def read_range(self, filename, offset, size):
+        """Returns up to size bytes of a stored file starting at offset, reading only the stripes that cover them."""
+        metadata = self._get_file_metadata(filename)
+        if offset < 0 or size < 0:
+            raise ValueError(f"Offset {offset} and size {size} of a read from {filename} must not be negative")
+        stripe_bytes = self.num_data_disk * self.chunk_size
+        file_size = metadata.get('file_size', metadata['num_stripes'] * stripe_bytes)
+        end = min(offset + size, file_size)
+        if offset >= end:
+            return b''
+
+        # File bytes are laid out contiguously over the data chunks of consecutive stripes
+        first_stripe = metadata['start_stripe'] + offset // stripe_bytes
+        last_stripe = metadata['start_stripe'] + (end - 1) // stripe_bytes
+        data = b''.join(self._iter_stripe_data(first_stripe, last_stripe + 1))
+        skip = offset % stripe_bytes
+        return data[skip:skip + end - offset]
+
+
+    def _get_file_metadata(self, filename):
+        if filename not in self.file_metadata:
+            raise FileNotFoundError(f"{filename} is not stored in the RAID")
+        return self.file_metadata[filename]
+
+
+    def _iter_stripe_data(self, start_stripe, end_stripe):
+        """Yields the data chunks of the stripes in [start_stripe, end_stripe) as bytes, max_inflight_stripes stripes at a time."""
+        while start_stripe < end_stripe:
+            num_stripes = min(self.max_inflight_stripes, end_stripe - start_stripe)
+            yield self._read_stripe_data(start_stripe, num_stripes)
+            start_stripe += num_stripes
+
+
+    def _read_stripe_data(self, start_stripe, num_stripes):
+        """Returns the data chunks of a range of stripes in file order, taking the stripes in the stripe cache from memory."""
+        if not self.cache.max_bytes:
+            return self._decode_stripe_data(start_stripe, num_stripes)
+
+        stripe_bytes = self.num_data_disk * self.chunk_size
+        stripes = [self.cache.get(stripe_index) for stripe_index in range(start_stripe, start_stripe + num_stripes)]
+        # Each run of stripes that are not cached is read and decoded at once
+        offset = 0
+        while offset < num_stripes:
+            if stripes[offset] is not None:
+                offset += 1
+                continue
+            end = offset
+            while end < num_stripes and stripes[end] is None:
+                end += 1
+            data = self._decode_stripe_data(start_stripe + offset, end - offset)
+            for stripe_offset in range(offset, end):
+                stripes[stripe_offset] = data[(stripe_offset - offset) * stripe_bytes:(stripe_offset - offset + 1) * stripe_bytes]
+                self.cache.put(start_stripe + stripe_offset, stripes[stripe_offset])
+            offset = end
+        return b''.join(stripes)
+
+
+    def _decode_stripe_data(self, start_stripe, num_stripes):
+        """Reads a range of stripes from the disks and returns their data chunks in file order."""
+        columns = self._read_columns(start_stripe, num_stripes, self._file_range(start_stripe))
+        with self.stats.phase('stripe', num_stripes * self.num_data_disk * self.chunk_size):
+            if self.kernel == 'stdlib':
+                data = bytearray()
+                for stripe_index, p_disk in enumerate(self.layout.p_disks[start_stripe:start_stripe + num_stripes]):
+                    cell = stripe_index * self.chunk_size
+                    for disk_index in self.layout.data_disks_by_p[p_disk]:
+                        data += columns[disk_index][cell:cell + self.chunk_size]
+                return bytes(data)
+            _, data_disks = self._block_roles(start_stripe, num_stripes)
+            return columns.transpose(1, 0, 2)[np.arange(num_stripes)[:, None], data_disks].tobytes()
+
+
+    def _file_range(self, stripe_index):
+        """Returns the (start_stripe, end_stripe) range of the file holding a stripe, or None for a free stripe."""
+        for metadata in self.file_metadata.values():
+            if metadata['start_stripe'] <= stripe_index < metadata['start_stripe'] + metadata['num_stripes']:
+                return metadata['start_stripe'], metadata['start_stripe'] + metadata['num_stripes']
+        return None
+
+
+    def _read_columns(self, start_stripe, num_stripes, stream=None):
+        """Reads a range of stripes from every disk into per-disk columns, reconstructing the cells of missing disks.
+
+        stream is the stripe range of the file being read sequentially, which lets the read-ahead prefetch the next stripes.
+        """
+        cells = self._new_columns(num_stripes)
+        # Disks already known to be failed are not read again in degraded mode
+        disk_contents = self.readahead.read([i for i in range(self.num_disk) if i not in self.failed_disks], start_stripe, num_stripes, stream)
+        for disk_index, disk_content in sorted(disk_contents.items()):
+            if disk_content is None:
+                print(f"Disk {disk_index} is missing, reading in degraded mode")
+                self.failed_disks.add(disk_index)
             else:
-                for stripe_index in range(self.total_stripes):
-                    for disk_index in range(self.num_disk):
-                        if disk_index in deleted_disks:
-                            self.matrix[stripe_index][disk_index] = [0] * self.chunk_size
-
-
-        # Reconstruct missing data
-        for stripe_index in range(self.total_stripes):
-            # Initialize the sums for this stripe, as arrays to handle each byte in the chunk
-            p_sum = [0] * self.chunk_size
-            q_sum = [0] * self.chunk_size
-            missing_disk1 = deleted_disks[0]
-            missing_disk2 = deleted_disks[1] if len(deleted_disks) == 2 else None
-            # Retrieve the P and Q parity locations
-            p_disk = self.P_loc[stripe_index][1]
-            q_disk = self.Q_loc[stripe_index][1]
-
-            for disk_index in range(self.num_disk):
-                data_val = self.matrix[stripe_index][disk_index]
-
-                # Accumulate known data values into p_sum and q_sum
-                if disk_index != missing_disk1 and (missing_disk2 is None or disk_index != missing_disk2):
-                    if disk_index != p_disk and disk_index != q_disk:
-                        for i in range(self.chunk_size):
-                            p_sum[i] ^= data_val[i]
-                            q_sum[i] ^= self.gf.mul(data_val[i], self.gf.exp(disk_index))
-
-            # If one disk is missing
-            if len(deleted_disks) == 1:
-                # Add the P parity value to p_sum for each byte
-                if deleted_disks[0] != p_disk:
-                    for i in range(self.chunk_size):
-                        p_sum[i] ^= self.matrix[stripe_index][p_disk][i]
+                # Short disk images read as zero padded stripes
+                memoryview(cells[disk_index]).cast('B')[:len(disk_content)] = disk_content
+
+        # Chunks that fail their checksum are reconstructed before they can leak into the missing disks' chunks
+        repairs = self._verify_block(cells, start_stripe, sorted(self.failed_disks))
+        if self.failed_disks:
+            self._recover_block(cells, start_stripe, sorted(self.failed_disks))
+        if repairs:
+            self._write_repairs(repairs)
+        return cells
+
+
+    def _new_columns(self, num_stripes):
+        """Returns zeroed columns of num_stripes chunks per disk: a (disks, stripes, chunk_size) array, or bytearrays for the stdlib kernel."""
+        if self.kernel == 'stdlib':
+            return [bytearray(num_stripes * self.chunk_size) for _ in range(self.num_disk)]
+        return np.zeros((self.num_disk, num_stripes, self.chunk_size), dtype=np.uint8)
+
+
+    def _read_disk_range(self, disk_index, start_stripe, num_stripes):
+        """Reads the chunks of a range of stripes from one disk, or returns None if the disk is missing."""
+        return self._read_disk_at(disk_index, start_stripe * self.chunk_size, num_stripes * self.chunk_size)
+
+
+    def _read_disk_at(self, disk_index, offset, size):
+        """Reads size bytes at offset of one disk image, or returns None if the disk is missing."""
+        with self.stats.phase(self._disk_phase('read'), size):
+            return self.backend.read_at(disk_index, offset, size)
+
+
+    def _write_disk_at(self, disk_index, writes):
+        """Overwrites (offset, data) regions of one disk image in place."""
+        with self.stats.phase(self._disk_phase('write'), sum(len(data) for _, data in writes)):
+            self.backend.write_many(disk_index, writes)
+
+
+    @profiled
+    @synchronized
+    def update_range(self, filename, offset, data):
+        """Overwrites part of a stored file in place, updating P and Q of only the touched stripes by read-modify-write."""
+        metadata = self._get_file_metadata(filename)
+        file_size = metadata.get('file_size', metadata['num_stripes'] * self.num_data_disk * self.chunk_size)
+        if offset < 0 or offset + len(data) > file_size:
+            raise ValueError(f"Range {offset}:{offset + len(data)} is outside of {filename} ({file_size} bytes)")
+
+        data = memoryview(data).cast('B')
+        disk_writes = {i: [] for i in range(self.num_disk)}
+        parity_deltas = {}
+        # Touched chunks are read whole, so they are verified and their new checksums can be computed
+        chunks = {}
+
+        # Compute the delta of every touched piece of a data chunk and accumulate it per stripe
+        position = offset
+        while position < offset + len(data):
+            chunk_index, start = divmod(position, self.chunk_size)
+            length = min(self.chunk_size - start, offset + len(data) - position)
+            stripe_index = metadata['start_stripe'] + chunk_index // self.num_data_disk
+            disk_index = self.layout.data_disks(stripe_index)[chunk_index % self.num_data_disk]
+
+            if (stripe_index, disk_index) not in chunks:
+                chunks[stripe_index, disk_index] = bytearray(self._read_chunk(stripe_index, disk_index))
+            chunk = chunks[stripe_index, disk_index]
+            new = data[position - offset:position - offset + length]
+            delta = self.gf.xor(chunk[start:start + length], new)
+            chunk[start:start + length] = new
+
+            if stripe_index not in parity_deltas:
+                parity_deltas[stripe_index] = [bytearray(self.chunk_size), bytearray(self.chunk_size), start, start + length]
+            P_delta, Q_delta, low, high = parity_deltas[stripe_index]
+            self.gf.mul_add_into(memoryview(P_delta)[start:start + length], delta, 1)
+            self.gf.mul_add_into(memoryview(Q_delta)[start:start + length], delta, self.gf.exp(disk_index))
+            parity_deltas[stripe_index][2:] = [min(low, start), max(high, start + length)]
+
+            # A failed disk is not written; its chunk follows from the updated parity
+            if disk_index not in self.failed_disks:
+                disk_writes[disk_index].append((stripe_index * self.chunk_size + start, bytes(new)))
+            position += length
+
+        # P ^= delta and Q ^= g^disk_index * delta over the touched bytes of each stripe
+        for stripe_index, (P_delta, Q_delta, low, high) in parity_deltas.items():
+            for parity_disk, parity_delta in ((self.layout.p_disk(stripe_index), P_delta), (self.layout.q_disk(stripe_index), Q_delta)):
+                chunk = bytearray(self._read_chunk(stripe_index, parity_disk))
+                chunk[low:high] = bytes(self.gf.xor(chunk[low:high], parity_delta[low:high]))
+                chunks[stripe_index, parity_disk] = chunk
+                if parity_disk not in self.failed_disks:
+                    disk_writes[parity_disk].append((stripe_index * self.chunk_size + low, bytes(chunk[low:high])))
+
+        for stripe_index in parity_deltas:
+            self._invalidate_stripes(stripe_index, stripe_index + 1)
+        for disk_index, writes in disk_writes.items():
+            if writes:
+                self._write_disk_at(disk_index, writes)
+        # Chunks of failed disks get the checksum of what their rebuild will produce
+        changed = []
+        if self.checksums is not None:
+            for (stripe_index, disk_index), chunk in chunks.items():
+                self.checksums[stripe_index * self.num_disk + disk_index] = zlib.crc32(chunk)
+                changed.append(stripe_index * self.num_disk + disk_index)
+        if self.failed_disks or isinstance(self.backend, HttpDisks):
+            # The failed disks missed the write and must look stale by their generation; on the disk server the replaced
+            # segments are recorded in the metadata
+            self.save_metadata()
+        elif changed:
+            self._write_checksums(changed)
+
+
+    def _read_chunk(self, stripe_index, disk_index):
+        """Reads one chunk, reconstructing it from its stripe if the disk has failed or the chunk fails its checksum."""
+        data_disks = self.layout.data_disks(stripe_index)
+        if self.cache.max_bytes and disk_index in data_disks:
+            stripe_data = self.cache.get(stripe_index)
+            if stripe_data is not None:
+                chunk = data_disks.index(disk_index) * self.chunk_size
+                return stripe_data[chunk:chunk + self.chunk_size]
+        if disk_index not in self.failed_disks:
+            chunk = self._read_disk_at(disk_index, stripe_index * self.chunk_size, self.chunk_size)
+            if chunk is None:
+                print(f"Disk {disk_index} is missing, reading in degraded mode")
+                self.failed_disks.add(disk_index)
+            elif len(chunk) == self.chunk_size and self._checksum_matches(stripe_index, disk_index, chunk):
+                return chunk
+        # The stripe read verifies, repairs and reconstructs the chunk
+        columns = self._read_columns(stripe_index, 1)
+        return bytes(self._cell(columns, disk_index, 0))
+
+
+    def _cell(self, columns, disk_index, stripe_offset):
+        """Returns a writable view of one chunk of a block's columns."""
+        return memoryview(columns[disk_index]).cast('B')[stripe_offset * self.chunk_size:(stripe_offset + 1) * self.chunk_size]
+
+
+    def _checksum_matches(self, stripe_index, disk_index, chunk):
+        return self.checksums is None or zlib.crc32(chunk) == self.checksums[stripe_index * self.num_disk + disk_index]
+
+
+    def _set_checksums(self, start_stripe, checksums):
+        """Stores the stripe-major checksums of a block starting at start_stripe, growing the array as stripes are appended."""
+        if self.checksums is None:
+            return
+        start = start_stripe * self.num_disk
+        if len(self.checksums) < start + len(checksums):
+            self.checksums.frombytes(bytes((start + len(checksums) - len(self.checksums)) * self.checksums.itemsize))
+        self.checksums[start:start + len(checksums)] = array.array('I', checksums)
+
+
+    def _block_checksums(self, columns):
+        """Returns the CRC32 of every chunk of a block's columns, stripe-major like self.checksums."""
+        views = [memoryview(column).cast('B') for column in columns]
+        num_stripes = len(views[0]) // self.chunk_size
+        with self.stats.phase('verify', len(views[0]) * self.num_disk):
+            return array.array('I', [zlib.crc32(view[cell:cell + self.chunk_size])
+                                     for cell in range(0, num_stripes * self.chunk_size, self.chunk_size) for view in views])
+
+
+    def _find_bad_chunks(self, columns, start_stripe, missing_disks):
+        """Returns the disks whose chunk fails its checksum, per stripe offset of the block, ignoring the missing disks and the free stripes."""
+        if self.checksums is None:
+            return {}
+        checksums = self._block_checksums(columns)
+        expected = self.checksums[start_stripe * self.num_disk:start_stripe * self.num_disk + len(checksums)]
+        if checksums == expected:
+            return {}
+        # Free stripes hold stale data whose layout is not known any more, e.g. zeros on a disk rebuilt since they were freed
+        free = self._free_offsets(start_stripe, len(checksums) // self.num_disk)
+        bad_chunks = {}
+        for index, (checksum, expected_checksum) in enumerate(zip(checksums, expected)):
+            stripe_offset, disk_index = divmod(index, self.num_disk)
+            if checksum != expected_checksum and disk_index not in missing_disks and stripe_offset not in free:
+                bad_chunks.setdefault(stripe_offset, []).append(disk_index)
+        return bad_chunks
+
+
+    def _verify_block(self, columns, start_stripe, missing_disks):
+        """Reconstructs the chunks of a block that fail their checksum and returns them as (stripe_index, disk_index, chunk) repairs."""
+        repairs = []
+        for stripe_offset, bad_disks in self._find_bad_chunks(columns, start_stripe, missing_disks).items():
+            stripe_index = start_stripe + stripe_offset
+            erasures = sorted(set(bad_disks) | set(missing_disks))
+            if len(erasures) > 2:
+                raise ValueError(f"Stripe {stripe_index} has unreadable chunks on disks {erasures}, RAID 6 can only recover up to two")
+            print(f"Stripe {stripe_index} failed its checksum on disks {bad_disks}, reconstructing")
+            chunks = self._repair_stripe(columns, stripe_offset, stripe_index, erasures)
+            repairs += [(stripe_index, disk_index, chunks[disk_index]) for disk_index in bad_disks]
+        return repairs
+
+
+    def _repair_stripe(self, columns, stripe_offset, stripe_index, erasures):
+        """Reconstructs the chunks of the erased disks of one stripe of a block in place and returns them by disk."""
+        decoder = self._get_decoder(tuple(erasures), self.layout.p_disk(stripe_index))
+        with self.stats.phase('decode', len(erasures) * self.chunk_size):
+            chunks = {disk_index: bytes(self.gf.linear_combination([self._cell(columns, d, stripe_offset) for d, _ in coefficients],
+                                                                   [coefficient for _, coefficient in coefficients]))
+                      for disk_index, coefficients in decoder.items()}
+        for disk_index, chunk in chunks.items():
+            self._cell(columns, disk_index, stripe_offset)[:] = chunk
+        return chunks
+
+
+    def _write_repairs(self, repairs):
+        """Writes repaired (stripe_index, disk_index, chunk) back to the disks."""
+        disk_writes = collections.defaultdict(list)
+        for stripe_index, disk_index, chunk in repairs:
+            disk_writes[disk_index].append((stripe_index * self.chunk_size, chunk))
+            self._invalidate_stripes(stripe_index, stripe_index + 1)
+        for disk_index, writes in disk_writes.items():
+            self._write_disk_at(disk_index, writes)
+        if isinstance(self.backend, HttpDisks):
+            # The replaced segments are recorded in the metadata
+            self.save_metadata()
+
+
+    def _recover_block(self, columns, start_stripe, missing_disks):
+        """Fills in the chunks of up to two missing disks, given one writable (stripes, chunk_size) array per disk.
+
+        Free stripes are not decoded, their P and Q disks are not known any more; they are left as they are, zero in a rebuild.
+        """
+        if len(missing_disks) > 2:
+            raise ValueError(f"Disks {missing_disks} are missing, RAID 6 can only recover up to two")
+
+        if self.kernel == 'stdlib':
+            return self._recover_block_stdlib(columns, start_stripe, missing_disks)
+
+        # Stripes with the same P disk share the same decoding matrix
+        with self.stats.phase('decode', len(missing_disks) * len(columns[0]) * self.chunk_size):
+            p_disks, _ = self._block_roles(start_stripe, len(columns[0]))
+            free = sorted(self._free_offsets(start_stripe, len(columns[0])))
+            for p_disk in np.unique(p_disks):
+                live = p_disks == p_disk
+                live[free] = False
+                rows = np.nonzero(live)[0]
+                if not len(rows):
+                    continue
+                decoder = self._get_decoder(tuple(missing_disks), int(p_disk))
+                for missing_disk, coefficients in decoder.items():
+                    cell = np.zeros((len(rows), self.chunk_size), dtype=np.uint8)
+                    for disk_index, coefficient in coefficients:
+                        self.gf.mul_add_into(cell, columns[disk_index][rows], coefficient)
+                    columns[missing_disk][rows] = cell
+
+
+    def _recover_block_stdlib(self, columns, start_stripe, missing_disks):
+        """Same as _recover_block for one bytearray column per disk, decoding whole columns with stdlib operations."""
+        num_stripes = len(columns[0]) // self.chunk_size
+        with self.stats.phase('decode', len(missing_disks) * num_stripes * self.chunk_size):
+            p_disks = self.layout.p_disks[start_stripe:start_stripe + num_stripes]
+            free = self._free_offsets(start_stripe, num_stripes)
+            views = [memoryview(column).cast('B') for column in columns]
+            for p_disk in sorted(set(p_disks)):
+                cells = [stripe_index * self.chunk_size for stripe_index, p in enumerate(p_disks) if p == p_disk and stripe_index not in free]
+                if not cells:
+                    continue
+                decoder = self._get_decoder(tuple(missing_disks), p_disk)
+                # The stripes of this P position are gathered so every survivor is decoded with a few C-level calls
+                gathered = {}
+                for coefficients in decoder.values():
+                    for disk_index, _ in coefficients:
+                        if disk_index not in gathered:
+                            gathered[disk_index] = b''.join(views[disk_index][cell:cell + self.chunk_size] for cell in cells)
+                for missing_disk, coefficients in decoder.items():
+                    decoded = memoryview(self.gf.linear_combination([gathered[disk_index] for disk_index, _ in coefficients],
+                                                                    [coefficient for _, coefficient in coefficients]))
+                    for n, cell in enumerate(cells):
+                        views[missing_disk][cell:cell + self.chunk_size] = decoded[n * self.chunk_size:(n + 1) * self.chunk_size]
+
+
+    def _get_decoder(self, missing_disks, p_disk):
+        """Returns, per missing disk, the coefficients of the surviving disks that reconstruct it; cached per failure pattern and P position."""
+        key = (missing_disks, p_disk)
+        decoder = self._decoders.get(key)
+        if decoder is not None:
+            return decoder
+
+        # Each disk of the stripe as a row of coefficients over the data chunks: unit rows for data, ones for P, g^disk_index for Q
+        q_disk = (p_disk + 1) % self.num_disk
+        data_disks = self.layout.data_disks_by_p[p_disk]
+        encoding = {d: [int(d == e) for e in data_disks] for d in data_disks}
+        encoding[p_disk] = [1] * len(data_disks)
+        encoding[q_disk] = [self.gf.exp(d) for d in data_disks]
+
+        # Any num_data_disk surviving disks determine the data, preferring data disks over P over Q
+        survivors = [d for d in data_disks + (p_disk, q_disk) if d not in missing_disks][:len(data_disks)]
+        decoding = self.gf.inv_matrix([encoding[d] for d in survivors])
+
+        decoder = {}
+        for missing_disk in missing_disks:
+            coefficients = []
+            for col, disk_index in enumerate(survivors):
+                coefficient = 0
+                for k, value in enumerate(encoding[missing_disk]):
+                    coefficient ^= self.gf.mul(value, decoding[k][col])
+                if coefficient:
+                    coefficients.append((disk_index, coefficient))
+            decoder[missing_disk] = coefficients
+
+        self._decoders[key] = decoder
+        return decoder
+
+
+    def _open_disk_outputs(self, append=False):
+        """Opens a writable output per disk from the disk backend.
+
+        With append=True the outputs continue after the existing stripes, otherwise they replace the whole disk.
+        """
+        if not append:
+            return [self.backend.replacer(i) for i in range(self.num_disk)]
+
+        # A compaction copying behind the last stripe loses its copies to the truncation below and starts over
+        self._invalidate_stripes(self.total_stripes)
+        disk_outputs = []
+        for i in range(self.num_disk):
+            if i in self.failed_disks or (not self.backend.exists(i) and self.total_stripes):
+                # A missing disk gets its new stripes back when it is rebuilt
+                self.failed_disks.add(i)
+                disk_outputs.append(open(os.devnull, 'wb'))
+                continue
+            # Cut off anything past the last stripe recorded in the metadata, e.g. from an interrupted append
+            self.backend.truncate(i, self.total_stripes * self.chunk_size)
+            disk_outputs.append(self.backend.writer(i, self.total_stripes * self.chunk_size))
+        return disk_outputs
 
-                if deleted_disks[0] != q_disk:
-                    # Recover the missing data using p_sum if Q parity was not deleted
-                    self.matrix[stripe_index][missing_disk1] = p_sum[:]
-                else:
-                    # Recover the missing data using q_sum if Q parity was deleted
-                    self.matrix[stripe_index][missing_disk1] = q_sum[:]
 
-            # If two disks are missing
-            elif len(deleted_disks) == 2:
-                # Add the P and Q parity values for each byte
-                if p_disk not in deleted_disks:
-                    for i in range(self.chunk_size):
-                        p_sum[i] ^= self.matrix[stripe_index][p_disk][i]
-                if q_disk not in deleted_disks:
-                    for i in range(self.chunk_size):
-                        q_sum[i] ^= self.matrix[stripe_index][q_disk][i]
-
-                dx = [0] * self.chunk_size
-                dy = [0] * self.chunk_size
-
-                for i in range(self.chunk_size):
-                    # If both P and Q are missing, just use p_sum and q_sum
-                    if p_disk in deleted_disks and q_disk in deleted_disks:
-                        if missing_disk1 == p_disk:
-                            dx[i] = p_sum[i]
-                            dy[i] = q_sum[i]
-                        else:
-                            dx[i] = q_sum[i]
-                            dy[i] = p_sum[i]
-                    # If P is missing, reconstruct using q_sum
-                    elif p_disk in deleted_disks:
-                        if missing_disk1 == p_disk:
-                            dy[i] = self.gf.div(q_sum[i], self.gf.exp(missing_disk2))
-                            p_sum[i] ^= dy[i]
-                            dx[i] = p_sum[i]
-                        if missing_disk2 == p_disk:
-                            dx[i] = self.gf.div(q_sum[i], self.gf.exp(missing_disk1))
-                            p_sum[i] ^= dx[i]
-                            dy[i] = p_sum[i]
-                    # If Q is missing, reconstruct using p_sum
-                    elif q_disk in deleted_disks:
-                        if missing_disk1 == q_disk:
-                            dy[i] = p_sum[i]
-                            q_sum[i] ^= self.gf.mul(dy[i], self.gf.exp(missing_disk2))
-                            dx[i] = q_sum[i]
-                        else:
-                            dx[i] = p_sum[i]
-                            q_sum[i] ^= self.gf.mul(dx[i], self.gf.exp(missing_disk2))
-                            dy[i] = q_sum[i]
-                    else:
-                        # General case where both missing disks are data disks
-                        dy[i] = self.gf.div(q_sum[i] ^ self.gf.mul(p_sum[i], self.gf.exp(missing_disk1)), self.gf.add(self.gf.exp(missing_disk1), self.gf.exp(missing_disk2)))
-                        dx[i] = p_sum[i] ^ dy[i]
-
-                # Store the reconstructed data in the matrix
-                self.matrix[stripe_index][missing_disk1] = dx
-                self.matrix[stripe_index][missing_disk2] = dy
-
-        disk_data = [bytearray() for _ in range(self.num_disk)]
-        
-        for filename, metadata in self.file_metadata.items():
-            start_stripe = metadata['start_stripe']
-            end_stripe = metadata['end_stripe']
-            recovered_data = bytearray()
+    def _close_disk_outputs(self, disk_outputs):
+        """Closes the per-disk outputs all at once, which overlaps the uploads of remote disks."""
+        with ThreadPoolExecutor(max_workers=self.num_disk) as executor:
+            for close in [executor.submit(self._close_output, output) for output in disk_outputs]:
+                close.result()
 
-            for stripe_index in range(start_stripe, end_stripe + 1):
-                for disk_index in range(self.num_disk):
-                    if (stripe_index, disk_index) not in self.P_loc and (stripe_index, disk_index) not in self.Q_loc:
-                        if self.matrix[stripe_index][disk_index] != [0] * self.chunk_size:
-                            recovered_data.extend(self.matrix[stripe_index][disk_index])
 
+    @profiled
+    @synchronized
+    def delete_disk(self, deleted_disks):
+        """Delete specified disks."""
+        for i in deleted_disks:
+            self.backend.delete(i)
+            self.failed_disks.add(i)
+            print(f"Disk {i} was deleted")
 
-            recovered_filename = f'recovered_{filename}'
-            print(f'recovered {filename}')
-            rec_dir = os.path.join(self.dir, 'Recovered_files')
-            with open(os.path.join(rec_dir, recovered_filename), 'wb') as f:
-                f.write(recovered_data)
+        self.disk_data = None
+        # The stripes a compaction already copied are gone from the deleted disks
+        self._move = None
+
+
+    @profiled
+    @synchronized
+    def rebuild_data(self, deleted_disks, recover_files=True):
+        """Rebuilds the deleted disks from the available ones and writes only their images back.
+
+        The surviving disks are read by one thread each, blocks are decoded by up to `workers` threads and every rebuilt
+        disk is streamed out by its own writer thread. With recover_files=True the files are also written to Recovered_files.
+        """
+        self.layout = self.recalculate_parity_locations()
+        # The rebuilt disks only get the stripes of files and leave a compaction's copies out
+        self._move = None
+        missing_disks = sorted(deleted_disks)
+        if len(missing_disks) > 2:
+            raise ValueError(f"Disks {missing_disks} are missing, RAID 6 can only recover up to two")
+        self.failed_disks = set(missing_disks)
+
+        readers = {i: ThreadPoolExecutor(max_workers=1) for i in range(self.num_disk) if i not in self.failed_disks}
+        writers = {i: ThreadPoolExecutor(max_workers=1) for i in missing_disks}
+
+        disk_outputs = {i: self.backend.replacer(i) for i in missing_disks}
+        repairs = []
+        try:
+            writes = collections.deque()
+            for columns, block_repairs in self._map_blocks(self._rebuild_block, self._read_blocks_ahead(readers)):
+                # Surviving chunks that failed their checksum are written back once the disks are no longer read
+                repairs += block_repairs
+                for i in missing_disks:
+                    writes.append(writers[i].submit(self._write_output, disk_outputs[i], columns[i]))
+                # Bound the number of decoded blocks waiting to be written
+                while len(writes) > len(missing_disks) * (self.workers + 1):
+                    writes.popleft().result()
+            for write in writes:
+                write.result()
+
+            closes = [writers[i].submit(self._close_output, disk_outputs[i]) for i in missing_disks]
+            for close in closes:
+                close.result()
+        finally:
+            for executor in list(readers.values()) + list(writers.values()):
+                executor.shutdown()
+
+        self.failed_disks.clear()
+        self.disk_data = None
+        if repairs:
+            self._write_repairs(repairs)
 
-        # Save data for each disk
-        for i in range(self.num_disk):
-            for stripe_index in range(len(self.matrix)):
-                disk_data[i].extend(self.matrix[stripe_index][i])
+        if recover_files:
+            rec_dir = os.path.join(self.dir, 'Recovered_files')
+            for filename in self.file_metadata:
+                recovered_filename = f'recovered_{filename}'
+                print(f'recovered {filename}')
+                with open(os.path.join(rec_dir, recovered_filename), 'wb') as f:
+                    for data in self.iter_file(filename):
+                        self._write_output(f, data)
 
-            if self.is_local:
-                with open(os.path.join(self.disks_dir, f'disk_{i}'), 'wb') as f:
-                    f.write(disk_data[i])
-            else:
-                file_id = client.upload_to_disk(i, disk_data[i])
-                self.file_dict[str(i)] = file_id
         print(f"Data reconstruction successful for disks {deleted_disks}.")
         self.save_metadata()
+
+
+    def _read_blocks_ahead(self, readers):
+        """Yields (start_stripe, num_stripes, reads) for every block of the array, with one read future per disk that has a reader.
+
+        Each disk is read by its own reader thread, and the reads of the next blocks are issued before the current one is processed.
+        """
+        reads = collections.deque()
+        for start_stripe in range(0, self.total_stripes, self.max_inflight_stripes):
+            num_stripes = min(self.max_inflight_stripes, self.total_stripes - start_stripe)
+            futures = [readers[i].submit(self._read_disk_range, i, start_stripe, num_stripes) if i in readers else None for i in range(self.num_disk)]
+            reads.append((start_stripe, num_stripes, futures))
+            if len(reads) > self.workers:
+                yield reads.popleft()
+        while reads:
+            yield reads.popleft()
+
+
+    def _columns_from_reads(self, num_stripes, reads):
+        """Returns the columns of a block filled from its per-disk read futures; disks without a read stay zero."""
+        columns = self._new_columns(num_stripes)
+        for disk_index, read in enumerate(reads):
+            if read is not None:
+                disk_content = read.result()
+                if disk_content is None:
+                    raise ValueError(f"Disk {disk_index} is missing but was not listed as deleted")
+                # Short disk images read as zero padded stripes
+                memoryview(columns[disk_index]).cast('B')[:len(disk_content)] = disk_content
+        return columns
+
+
+    def _rebuild_block(self, start_stripe, num_stripes, reads):
+        """Decodes one block of stripes from the per-disk reads and returns one (stripes, chunk_size) array per disk and the repairs of bad surviving chunks."""
+        columns = self._columns_from_reads(num_stripes, reads)
+        repairs = self._verify_block(columns, start_stripe, sorted(self.failed_disks))
+
+        # The decoders derive the recovery coefficients once per failure pattern and P position
+        self._recover_block(columns, start_stripe, sorted(self.failed_disks))
+        return columns, repairs
+
+
+    @profiled
+    @synchronized
+    def scrub(self, repair=True):
+        """Verifies the checksum of every chunk and the P and Q parity of every stripe, repairing what can be repaired.
+
+        The disks are streamed like in rebuild_data and the blocks are verified by up to `workers` threads. A chunk that fails
+        its checksum is reconstructed from the rest of its stripe, and in a stripe whose parity does not add up the bad chunk
+        is located with the Q syndrome. With repair=False nothing is written. Arrays without checksums get them from the scrub.
+
+        Returns the number of stripes, the (stripe, disk) checksum errors, the stripes with parity errors, the (stripe, disk)
+        chunks repaired (or 'repairable') and the stripes that could not be repaired.
+        """
+        missing_disks = [i for i in range(self.num_disk) if i in self.failed_disks or not self.backend.exists(i)]
+        if missing_disks:
+            raise ValueError(f"Disks {missing_disks} are missing, rebuild them before scrubbing")
+
+        start = time.perf_counter()
+        report = {'stripes': self.total_stripes, 'checksum_errors': [], 'parity_errors': [], 'unrecoverable': []}
+        checksums = array.array('I') if self.checksums is None else None
+        repairs = []
+        readers = {i: ThreadPoolExecutor(max_workers=1) for i in range(self.num_disk)}
+        try:
+            for errors, block_repairs, block_checksums in self._map_blocks(self._scrub_block, self._read_blocks_ahead(readers)):
+                for key, values in errors.items():
+                    report[key] += values
+                repairs += block_repairs
+                if checksums is not None:
+                    checksums += block_checksums
+        finally:
+            for executor in readers.values():
+                executor.shutdown()
+
+        report['repaired' if repair else 'repairable'] = [(stripe_index, disk_index) for stripe_index, disk_index, _ in repairs]
+        if repair:
+            if repairs:
+                self._write_repairs(repairs)
+            if checksums is not None:
+                self.checksums = checksums
+                self.save_metadata()
+
+        seconds = time.perf_counter() - start
+        scrubbed_mb = self.total_stripes * self.num_disk * self.chunk_size / (1 << 20)
+        print(f"Scrubbed {self.total_stripes} stripes in {seconds:.2f}s ({scrubbed_mb / seconds if seconds else 0:.1f} MB/s): "
+              f"{len(report['checksum_errors'])} checksum errors, {len(report['parity_errors'])} parity errors, "
+              f"{len(repairs)} chunks {'repaired' if repair else 'repairable'}, {len(report['unrecoverable'])} stripes unrecoverable")
+        return report
+
+
+    def _scrub_block(self, start_stripe, num_stripes, reads):
+        """Verifies one block of stripes and returns its errors, the repairs of its bad chunks and, for arrays without checksums, its checksums."""
+        columns = self._columns_from_reads(num_stripes, reads)
+        errors = {'checksum_errors': [], 'parity_errors': [], 'unrecoverable': []}
+        repairs = []
+        # Free stripes hold stale data, possibly laid out for a different file
+        free = self._free_offsets(start_stripe, num_stripes)
+
+        for stripe_offset, bad_disks in self._find_bad_chunks(columns, start_stripe, []).items():
+            stripe_index = start_stripe + stripe_offset
+            errors['checksum_errors'] += [(stripe_index, disk_index) for disk_index in bad_disks]
+            if len(bad_disks) > 2:
+                errors['unrecoverable'].append(stripe_index)
+                continue
+            chunks = self._repair_stripe(columns, stripe_offset, stripe_index, sorted(bad_disks))
+            repairs += [(stripe_index, disk_index, chunks[disk_index]) for disk_index in bad_disks]
+
+        unrecoverable = {stripe_index - start_stripe for stripe_index in errors['unrecoverable']}
+        for stripe_offset, (P_syndrome, Q_syndrome) in self._parity_syndromes(columns, start_stripe, free | unrecoverable).items():
+            stripe_index = start_stripe + stripe_offset
+            errors['parity_errors'].append(stripe_index)
+            disk_index = self._locate_bad_chunk(stripe_index, P_syndrome, Q_syndrome)
+            if disk_index is None:
+                errors['unrecoverable'].append(stripe_index)
+                continue
+            chunk = self._repair_stripe(columns, stripe_offset, stripe_index, [disk_index])[disk_index]
+            if not self._checksum_matches(stripe_index, disk_index, chunk):
+                # The located chunk matched its checksum before, so the stripe has more than one bad chunk
+                errors['unrecoverable'].append(stripe_index)
+                continue
+            print(f"Stripe {stripe_index} has a bad chunk on disk {disk_index}, reconstructing")
+            repairs.append((stripe_index, disk_index, chunk))
+
+        checksums = self._block_checksums(columns) if self.checksums is None else None
+        return errors, repairs, checksums
+
+
+    def _free_offsets(self, start_stripe, num_stripes):
+        """Returns the offsets of the stripes of a block that lie in the free extents."""
+        free = set()
+        for start, length in self.free_extents:
+            free.update(range(max(start, start_stripe) - start_stripe, min(start + length, start_stripe + num_stripes) - start_stripe))
+        return free
+
+
+    def _parity_syndromes(self, columns, start_stripe, skip):
+        """Returns the P and Q syndromes, P ^ sum(D) and Q ^ sum(g^disk_index * D), of the stripes of a block whose parity does not add up."""
+        num_stripes = len(memoryview(columns[0]).cast('B')) // self.chunk_size
+        p_disks = self.layout.p_disks[start_stripe:start_stripe + num_stripes]
+        zero_chunk = bytes(self.chunk_size)
+        syndromes = {}
+        with self.stats.phase('verify', num_stripes * self.num_disk * self.chunk_size):
+            # Stripes with the same P disk are checked together, like in decoding
+            for p_disk in sorted(set(p_disks)):
+                offsets = [stripe_offset for stripe_offset, p in enumerate(p_disks) if p == p_disk and stripe_offset not in skip]
+                if not offsets:
+                    continue
+                q_disk = (p_disk + 1) % self.num_disk
+                data_disks = self.layout.data_disks_by_p[p_disk]
+                cells = {disk_index: self._gather_cells(columns, disk_index, offsets) for disk_index in data_disks + (p_disk, q_disk)}
+                P_syndrome = bytes(self.gf.linear_combination([cells[d] for d in data_disks + (p_disk,)], [1] * (len(data_disks) + 1)))
+                Q_syndrome = bytes(self.gf.linear_combination([cells[d] for d in data_disks + (q_disk,)], [self.gf.exp(d) for d in data_disks] + [1]))
+                if P_syndrome == Q_syndrome == bytes(len(P_syndrome)):
+                    continue
+                for n, stripe_offset in enumerate(offsets):
+                    cell = slice(n * self.chunk_size, (n + 1) * self.chunk_size)
+                    if P_syndrome[cell] != zero_chunk or Q_syndrome[cell] != zero_chunk:
+                        syndromes[stripe_offset] = (P_syndrome[cell], Q_syndrome[cell])
+        return syndromes
+
+
+    def _gather_cells(self, columns, disk_index, offsets):
+        """Returns the chunks of one disk at the given stripe offsets of a block as one contiguous buffer."""
+        if self.kernel == 'stdlib':
+            view = memoryview(columns[disk_index])
+            return b''.join(view[offset * self.chunk_size:(offset + 1) * self.chunk_size] for offset in offsets)
+        return columns[disk_index][offsets]
+
+
+    def _locate_bad_chunk(self, stripe_index, P_syndrome, Q_syndrome):
+        """Returns the disk whose chunk explains the syndromes of a stripe with a single bad chunk, or None if no single chunk does."""
+        if not any(P_syndrome):
+            return self.layout.q_disk(stripe_index)
+        if not any(Q_syndrome):
+            return self.layout.p_disk(stripe_index)
+        # An error e in the data chunk of disk z adds e to P and g^z * e to Q, so Q / P is g^z at every byte
+        logs = {(self.gf.log_table[q] - self.gf.log_table[p]) % (self.gf.field_size - 1) if p and q else None
+                for p, q in zip(P_syndrome, Q_syndrome) if p or q}
+        if len(logs) != 1 or None in logs:
+            return None
+        disk_index = logs.pop()
+        return disk_index if disk_index in self.layout.data_disks(stripe_index) else None
@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Reads stripe ranges from all disks at once and prefetches ahead of sequential reads
+class ReadAhead:
+    def __init__(self, read_range, num_disk, chunk_size, max_stripes):
+        """read_range(disk_index, start_stripe, num_stripes) reads from one disk; up to max_stripes stripes are prefetched.
+
+        Every disk has its own reader thread, so the disks are read concurrently while each disk is read in order. The
+        object is used by one thread at a time, the RAID's lock guarantees that.
+        """
+        self.read_range = read_range
+        self.num_disk = num_disk
+        self.chunk_size = chunk_size
+        self.max_stripes = max_stripes
+        self.window = 0
+        # The (start_stripe, end_stripe) range of the file read last and the (start_stripe, num_stripes, contents by disk) of its last read
+        self.stream = None
+        self.last_read = None
+        # (start_stripe, num_stripes, futures by disk) of the prefetched ranges, in stripe order
+        self.prefetched = []
+        self._readers = None
+        self.prefetched_stripes = 0
+        self.used_stripes = 0
+        self.dropped_stripes = 0
+
+    def _reader(self, disk_index):
+        if self._readers is None:
+            self._readers = [ThreadPoolExecutor(max_workers=1) for _ in range(self.num_disk)]
+        return self._readers[disk_index]
+
+    def read(self, disks, start_stripe, num_stripes, stream=None):
+        """Returns the content of [start_stripe, start_stripe + num_stripes) of each disk in disks, None where a disk is missing.
+
+        stream is the (start_stripe, end_stripe) range of the file being read. Reads that start at the beginning of the file
+        or continue the previous read of the same file, possibly overlapping its last stripes, are sequential and double the
+        prefetch window; other reads reset it.
+        """
+        end_stripe = start_stripe + num_stripes
+        continues = stream is not None and stream == self.stream and self.last_read is not None and (
+            self.last_read[0] <= start_stripe <= self.last_read[0] + self.last_read[1])
+        sequential = continues or (stream is not None and start_stripe == stream[0])
+        if stream is not None and not continues:
+            # A read that does not continue the previous one, e.g. of another file, has no use for the prefetched ranges
+            self.invalidate()
+            self.window = 0
+            self.stream = stream
+
+        reads = self._take_prefetched(disks, start_stripe, end_stripe)
+        if reads is None:
+            # The current range is requested before any new prefetch, so it does not queue behind it
+            reads = {disk_index: self._reader(disk_index).submit(self.read_range, disk_index, start_stripe, num_stripes) for disk_index in disks}
+
+        if sequential and self.max_stripes:
+            self.window = min(max(2 * self.window, num_stripes), self.max_stripes)
+            self._prefetch(disks, end_stripe, min(end_stripe + self.window, stream[1]), num_stripes)
+
+        contents = {disk_index: read.result() for disk_index, read in reads.items()}
+        if stream is not None:
+            # The next sequential read may start within the last stripes of this one
+            self.last_read = (start_stripe, num_stripes, {disk_index: _Done(content) for disk_index, content in contents.items()})
+        return contents
+
+    def _take_prefetched(self, disks, start_stripe, end_stripe):
+        """Returns the reads of a range if the last read and the prefetched ranges cover it, dropping the prefetched ranges up to its end."""
+        candidates = ([self.last_read] if self.last_read is not None else []) + self.prefetched
+        pieces = []
+        position = start_stripe
+        for range_start, range_stripes, futures in candidates:
+            if range_start <= position < range_start + range_stripes and all(d in futures for d in disks):
+                piece_end = min(range_start + range_stripes, end_stripe)
+                pieces.append((position, piece_end, range_start, futures))
+                position = piece_end
+                if position >= end_stripe:
+                    break
+        if position < end_stripe:
+            return None
+
+        kept = []
+        for prefetch in self.prefetched:
+            range_start, range_stripes, _ = prefetch
+            if range_start + range_stripes > end_stripe:
+                kept.append(prefetch)
+            elif not any(futures is prefetch[2] for _, _, _, futures in pieces):
+                self.dropped_stripes += range_stripes
+        self.prefetched = kept
+        self.used_stripes += end_stripe - start_stripe
+        return {disk_index: _Slice(pieces, disk_index, self.chunk_size) for disk_index in disks}
+
+    def _prefetch(self, disks, start_stripe, end_stripe, unit):
+        """Issues reads of [start_stripe, end_stripe) not already prefetched, in ranges of unit stripes."""
+        while start_stripe < end_stripe:
+            prefetched = next((range_start + range_stripes for range_start, range_stripes, _ in self.prefetched
+                               if range_start <= start_stripe < range_start + range_stripes), None)
+            if prefetched is not None:
+                start_stripe = prefetched
+                continue
+            # A new range stops where an already prefetched one starts
+            num_stripes = min([unit, end_stripe - start_stripe] + [range_start - start_stripe for range_start, _, _ in self.prefetched if range_start > start_stripe])
+            futures = {disk_index: self._reader(disk_index).submit(self.read_range, disk_index, start_stripe, num_stripes) for disk_index in disks}
+            self.prefetched.append((start_stripe, num_stripes, futures))
+            self.prefetched_stripes += num_stripes
+            start_stripe += num_stripes
+        self.prefetched.sort(key=lambda prefetch: prefetch[0])
+
+    def invalidate(self):
+        """Drops all prefetched ranges, waiting for reads in progress so no prefetch runs while the disks are written."""
+        for _, num_stripes, futures in self.prefetched:
+            for future in futures.values():
+                if not future.cancel():
+                    future.exception()
+            self.dropped_stripes += num_stripes
+        self.prefetched = []
+        self.last_read = None
+
+    def close(self):
+        self.invalidate()
+        if self._readers is not None:
+            for reader in self._readers:
+                reader.shutdown()
+            self._readers = None
+
+    def as_dict(self):
+        return {'window': self.window, 'prefetched_stripes': self.prefetched_stripes, 'used_stripes': self.used_stripes,
+                'dropped_stripes': self.dropped_stripes}
+
+
+class _Done:
+    """The already known content of a disk range, used like the futures of the prefetched ranges."""
+    def __init__(self, content):
+        self.content = content
+
+    def result(self):
+        return self.content
+
+
+class _Slice:
+    """One disk's content of a range, assembled from (start_stripe, end_stripe, range_start, futures) pieces of read ranges."""
+    def __init__(self, pieces, disk_index, chunk_size):
+        self.pieces = pieces
+        self.disk_index = disk_index
+        self.chunk_size = chunk_size
+
+    def result(self):
+        data = bytearray()
+        for start_stripe, end_stripe, range_start, futures in self.pieces:
+            content = futures[self.disk_index].result()
+            if content is None:
+                return None
+            if len(self.pieces) == 1 and start_stripe == range_start and len(content) == (end_stripe - start_stripe) * self.chunk_size:
+                return content
+            piece = content[(start_stripe - range_start) * self.chunk_size:(end_stripe - range_start) * self.chunk_size]
+            # Short disk images read as zero padded stripes
+            data += piece
+            data += bytes((end_stripe - start_stripe) * self.chunk_size - len(piece))
+        return bytes(data)
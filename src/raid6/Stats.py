@@ -0,0 +1,81 @@
+import os
+import time
+import cProfile
+import threading
+import contextlib
+
+
+# Time and byte counters per phase of the RAID 6 operations
+class Stats:
+    PHASES = ('read', 'stripe', 'encode', 'decode', 'verify', 'write', 'network')
+
+    def __init__(self, profile_dir=None):
+        """Counts seconds, bytes and calls per phase; with profile_dir set every operation is also run under cProfile."""
+        self.callbacks = []
+        self.profile_dir = profile_dir if profile_dir is not None else os.environ.get('RAID6_PROFILE_DIR')
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._num_profiles = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.seconds = dict.fromkeys(self.PHASES, 0.0)
+            self.bytes = dict.fromkeys(self.PHASES, 0)
+            self.calls = dict.fromkeys(self.PHASES, 0)
+
+    def add_callback(self, callback):
+        """Registers callback(phase, seconds, num_bytes), called after every timed step, e.g. to feed a metrics pipeline."""
+        self.callbacks.append(callback)
+
+    def add(self, phase, seconds, num_bytes=0):
+        """Records one step of a phase."""
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.bytes[phase] += num_bytes
+            self.calls[phase] += 1
+        for callback in self.callbacks:
+            callback(phase, seconds, num_bytes)
+
+    @contextlib.contextmanager
+    def phase(self, phase, num_bytes=0):
+        """Times the enclosed step as part of a phase. Steps running in parallel threads are all counted."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, num_bytes)
+
+    @contextlib.contextmanager
+    def profile(self, operation):
+        """Runs the enclosed operation under cProfile and dumps the result to profile_dir, if profiling is enabled.
+
+        Only the calling thread is profiled, and operations started while another one is profiled are part of its profile.
+        """
+        with self._lock:
+            profiling = bool(self.profile_dir) and not self._profiling
+            if profiling:
+                self._profiling = True
+        if not profiling:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiling = False
+                self._num_profiles += 1
+                profile_file = os.path.join(self.profile_dir, f'{operation}_{self._num_profiles}.prof')
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(profile_file)
+
+    def as_dict(self):
+        """Returns the counters as {phase: {'seconds', 'bytes', 'calls'}}."""
+        with self._lock:
+            return {phase: {'seconds': self.seconds[phase], 'bytes': self.bytes[phase], 'calls': self.calls[phase]} for phase in self.PHASES}
+
+    def __repr__(self):
+        return 'Stats(' + ', '.join(f'{phase}={self.seconds[phase]:.3f}s/{self.bytes[phase]}B' for phase in self.PHASES) + ')'
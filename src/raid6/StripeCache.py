@@ -0,0 +1,70 @@
+import threading
+import collections
+
+
+# Least recently used cache of the decoded data of stripes, limited by the bytes it holds
+class StripeCache:
+    def __init__(self, max_bytes=0):
+        """Keeps up to max_bytes of stripe data by stripe index; with max_bytes=0 nothing is cached."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, stripe_index):
+        """Returns the cached data of a stripe and marks it as most recently used, or None."""
+        with self._lock:
+            data = self._entries.get(stripe_index)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(stripe_index)
+            self.hits += 1
+            return data
+
+    def put(self, stripe_index, data):
+        """Caches the data of a stripe, evicting the least recently used stripes to stay within max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(stripe_index, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[stripe_index] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, start_stripe, end_stripe=None):
+        """Drops the stripes in [start_stripe, end_stripe), or from start_stripe on if end_stripe is None."""
+        with self._lock:
+            if end_stripe is not None and end_stripe - start_stripe <= len(self._entries):
+                stripe_indices = range(start_stripe, end_stripe)
+            else:
+                stripe_indices = [i for i in self._entries if i >= start_stripe and (end_stripe is None or i < end_stripe)]
+            for stripe_index in stripe_indices:
+                data = self._entries.pop(stripe_index, None)
+                if data is not None:
+                    self.size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def as_dict(self):
+        """Returns the counters and the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'stripes': len(self._entries),
+                    'bytes': self.size, 'max_bytes': self.max_bytes}
+
+    def __repr__(self):
+        return f'StripeCache(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, bytes={self.size}/{self.max_bytes})'
@@ -0,0 +1,67 @@
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.raid6.RAID6_bin import RAID6
+
+
+ARRAY_DIRS = ('files', 'disks', 'Initial_distributed_files', 'Recovered_files', 'Reloaded_Initial_distributed_files')
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def make_array(base, files, chunk_size=16, num_disk=6, **kwargs):
+    """Creates an array under base holding files, a dict of file name to content, and returns the RAID."""
+    for name in ARRAY_DIRS:
+        os.makedirs(os.path.join(base, name), exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(base, 'files', name), 'wb') as f:
+            f.write(data)
+    raid = RAID6(chunk_size=chunk_size, num_disk=num_disk, dir=base, **kwargs)
+    raid.distribute_data(None)
+    return raid
+
+
+def open_array(base, **kwargs):
+    return RAID6(dir=base, existing_dir=base, **kwargs)
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path)
+
+
+@pytest.fixture
+def disk_server(monkeypatch):
+    """Replaces the disk server client with an in-memory store of (disk_number, file_id) to content."""
+    import src.cloud_implementation.api_client as client
+    store = {}
+
+    def upload_to_disk(disk_number, chunk_data):
+        file_id = str(len(store) + sum(1 for _ in disk_server.deleted))
+        store[disk_number, file_id] = bytes(chunk_data)
+        return file_id
+
+    def get_disk_data(disk_number, file_id, offset=0, size=None):
+        data = store.get((disk_number, file_id))
+        if data is None:
+            return None
+        return data[offset:] if size is None else data[offset:offset + size]
+
+    def delete_file(disk_number, file_id):
+        disk_server.deleted.append(store.pop((disk_number, file_id), None))
+
+    disk_server.deleted = []
+    monkeypatch.setattr(client, 'upload_to_disk', upload_to_disk)
+    monkeypatch.setattr(client, 'get_disk_data', get_disk_data)
+    monkeypatch.setattr(client, 'delete_file', delete_file)
+    monkeypatch.setattr(client, 'upload_to_disks', lambda chunks: [upload_to_disk(*chunk) for chunk in chunks])
+    monkeypatch.setattr(client, 'get_disks_data', lambda files: [get_disk_data(*file) for file in files])
+    monkeypatch.setattr(client, 'delete_files', lambda files: [delete_file(*file) for file in files])
+    return store
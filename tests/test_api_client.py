@@ -0,0 +1,139 @@
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('mongomock')
+uvicorn = pytest.importorskip('uvicorn')
+
+from conftest import random_bytes
+from src.cloud_implementation import server
+from src.cloud_implementation import api_client as client
+
+
+class FaultyServer:
+    """Runs the server in front of mongomock and records its requests; faults[method] requests answer 503.
+
+    A faulty POST is still stored and only its response is replaced, like an upload whose response was lost.
+    """
+    def __init__(self):
+        self.faults = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await server.app(scope, receive, send)
+        method = scope['method']
+        self.requests.append((method, scope['path'], scope['client'][1]))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Overlapping requests are in flight at the same time
+            await asyncio.sleep(0.01)
+            if not self.faults.get(method):
+                return await server.app(scope, receive, send)
+            self.faults[method] -= 1
+            if method == 'POST':
+                async def drop(message):
+                    pass
+                await server.app(scope, receive, drop)
+            await send({'type': 'http.response.start', 'status': 503, 'headers': [(b'content-length', b'11')]})
+            await send({'type': 'http.response.body', 'body': b'unavailable'})
+        finally:
+            self.in_flight -= 1
+
+    def requests_of(self, method):
+        return [request for request in self.requests if request[0] == method]
+
+    def num_files(self, disk_number):
+        return len(list(server.get_disk_fs(disk_number).find({})))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def faulty_server(monkeypatch):
+    monkeypatch.setattr(server, 'DISK_BACKEND', 'mongomock')
+    monkeypatch.setattr(server, '_disk_fs', {})
+    app = FaultyServer()
+    port = free_port()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', lifespan='off'))
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        time.sleep(0.01)
+
+    for name in ('BASE_URL', 'CONCURRENCY', 'RETRIES', 'BACKOFF'):
+        monkeypatch.setattr(client, name, getattr(client, name))
+    client.configure(base_url=f'http://127.0.0.1:{port}', concurrency=4, retries=3, backoff=0.05)
+    yield app
+    client.close()
+    uvicorn_server.should_exit = True
+    thread.join()
+
+
+def test_round_trip(faulty_server):
+    data = random_bytes(3 * client.STREAM_CHUNK_SIZE + 5)
+    file_id = client.upload_to_disk(1, data)
+    assert client.get_disk_data(1, file_id) == data
+    assert client.get_disk_data(1, file_id, 10, 20) == data[10:30]
+    assert client.get_disk_data(1, file_id, len(data), 10) == b''
+    client.delete_file(1, file_id)
+    assert client.get_disk_data(1, file_id) is None
+
+
+def test_server_errors_are_retried_with_backoff(faulty_server):
+    file_id = client.upload_to_disk(0, b'data')
+    faulty_server.faults['GET'] = 2
+    start = time.perf_counter()
+    assert client.get_disk_data(0, file_id) == b'data'
+    # Two retries after waiting 0.05s and 0.1s
+    assert time.perf_counter() - start >= 0.15
+    assert len(faulty_server.requests_of('GET')) == 3
+
+    # The last attempt's error is raised
+    faulty_server.faults['GET'] = 3
+    with pytest.raises(ConnectionError):
+        client.get_disk_data(0, file_id)
+    assert len(faulty_server.requests_of('GET')) == 6
+
+
+def test_uploads_are_not_retried(faulty_server):
+    faulty_server.faults['POST'] = 1
+    with pytest.raises(ConnectionError):
+        client.upload_to_disk(2, b'data')
+    # The upload reached the server once, a retry would have stored a second copy
+    assert len(faulty_server.requests_of('POST')) == 1
+    assert faulty_server.num_files(2) == 1
+
+
+def test_uploads_retry_when_the_server_cannot_be_reached(faulty_server, monkeypatch):
+    monkeypatch.setattr(client, 'BASE_URL', f'http://127.0.0.1:{free_port()}')
+    start = time.perf_counter()
+    with pytest.raises(client.ERRORS):
+        client.upload_to_disk(2, b'data')
+    # Every attempt failed to connect and was retried after 0.05s and 0.1s
+    assert time.perf_counter() - start >= 0.15
+
+
+def test_connections_are_pooled(faulty_server):
+    file_ids = client.upload_to_disks([(3, random_bytes(1000, seed=n)) for n in range(20)])
+    # No more than CONCURRENCY requests are in flight, over no more than CONCURRENCY connections
+    assert faulty_server.max_in_flight > 1
+    assert faulty_server.max_in_flight <= 4
+    assert len({port for _, _, port in faulty_server.requests}) <= 4
+
+    requests = len(faulty_server.requests)
+    for file_id in file_ids[:5]:
+        client.get_disk_data(3, file_id)
+    # Later requests reuse the kept-alive connections instead of opening new ones
+    assert {port for _, _, port in faulty_server.requests[requests:]} <= {port for _, _, port in faulty_server.requests[:requests]}
@@ -0,0 +1,128 @@
+import os
+
+from conftest import random_bytes, make_array, open_array
+from src.raid6.DiskBackend import MmapDisks
+
+
+FILES = {'a.jpg': random_bytes(3001, seed=1), 'b.mp3': random_bytes(1333, seed=2), 'c.pdf': random_bytes(800, seed=3)}
+
+
+def test_mmap_reads_are_zero_copy(base):
+    raid = make_array(base, FILES, use_mmap=True)
+    assert isinstance(raid.backend, MmapDisks)
+    chunk = raid.backend.read_at(0, 32, 16)
+    assert isinstance(chunk, memoryview) and len(chunk) == 16
+    # The mapping is reused, and a read past the end of the image is cut short
+    assert raid.backend.read_at(0, 0, 16).obj is chunk.obj
+    assert len(raid.backend.read_at(0, raid.total_stripes * raid.chunk_size - 4, 16)) == 4
+    assert raid.backend.read_at(0, 0, 0) == b''
+    os.remove(raid.backend.path(5))
+    raid.backend._drop_mapping(5)
+    assert raid.backend.read_at(5, 0, 16) is None
+
+
+def test_mmap_array(base):
+    raid = make_array(base, FILES, use_mmap=True, max_inflight_stripes=8)
+    assert {name: raid.read_file(name) for name in FILES} == FILES
+
+    # In place writes are seen through the mapping
+    raid.update_range('a.jpg', 100, b'x' * 50)
+    expected = dict(FILES, **{'a.jpg': FILES['a.jpg'][:100] + b'x' * 50 + FILES['a.jpg'][150:]})
+    assert raid.read_file('a.jpg') == expected['a.jpg']
+
+    # Appends grow the images past the mapping, deletion and compaction cut them
+    os.remove(os.path.join(base, 'files', 'b.mp3'))
+    new = random_bytes(2000, seed=4)
+    with open(os.path.join(base, 'files', 'd.pdf'), 'wb') as f:
+        f.write(new)
+    raid.distribute_data(base)
+    del expected['b.mp3']
+    expected['d.pdf'] = new
+    assert {name: raid.read_file(name) for name in expected} == expected
+    os.remove(os.path.join(base, 'files', 'd.pdf'))
+    raid.distribute_data(base)
+    del expected['d.pdf']
+    raid.compact()
+    assert {name: raid.read_file(name) for name in expected} == expected
+
+    # Degraded reads, rebuild and scrub go through the mappings too
+    raid.delete_disk([1, 4])
+    assert raid.read_range('c.pdf', 10, 500) == expected['c.pdf'][10:510]
+    raid.rebuild_data([1, 4], recover_files=False)
+    assert {name: raid.read_file(name) for name in expected} == expected
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+    raid.load_existing_data()
+    assert {name: open_array(base, use_mmap=True).read_file(name) for name in expected} == expected
+
+
+def test_remote_writes_are_uploaded_per_segment(base, disk_server):
+    import tracemalloc
+    segment_size = 16 * 64
+    files = {'a.jpg': random_bytes(2 << 20, seed=1)}
+    tracemalloc.start()
+    try:
+        raid = make_array(base, files, chunk_size=64, num_disk=6, is_local=False, segment_stripes=16, max_inflight_stripes=32)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Only about a block and a segment per disk are held on top of what stays, never the whole disk images
+    assert peak - current < 256 * 1024
+    assert all(len(data) <= segment_size for data in disk_server.values())
+    assert raid.read_file('a.jpg') == files['a.jpg']
+
+    # Appends and rebuilds are uploaded per segment as well
+    new = random_bytes(100000, seed=2)
+    with open(os.path.join(base, 'files', 'b.mp3'), 'wb') as f:
+        f.write(new)
+    raid.distribute_data(base)
+    files['b.mp3'] = new
+    num_segments = len(raid.backend.disk_segments(2))
+    raid.delete_disk([2])
+    raid.rebuild_data([2], recover_files=False)
+    assert len(raid.backend.disk_segments(2)) == num_segments
+    assert all(len(data) <= segment_size for data in disk_server.values())
+    raid = open_array(base)
+    assert {name: raid.read_file(name) for name in files} == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_remote_replacer_swaps_segments_on_close(base, disk_server):
+    raid = make_array(base, {'a.jpg': random_bytes(5000, seed=1)}, chunk_size=16, num_disk=5, is_local=False, segment_stripes=4)
+    old_image = raid.backend.read_at(1, 0, raid.backend.size(1))
+    old_files = {segment['file_id'] for segment in raid.backend.disk_segments(1)}
+
+    output = raid.backend.replacer(1)
+    output.write(b'x' * 96)
+    output.write(b'y' * 112)
+    # Complete segments are uploaded right away, but the disk keeps its old image until the output is closed
+    assert any(data == b'x' * 64 for data in disk_server.values())
+    assert raid.backend.read_at(1, 0, len(old_image)) == old_image
+    output.close()
+    assert raid.backend.read_at(1, 0, 208) == b'x' * 96 + b'y' * 112
+    assert [segment['num_stripes'] for segment in raid.backend.disk_segments(1)] == [4, 4, 4, 1]
+    # The old segments are deleted once the metadata no longer refers to them
+    assert all((1, file_id) in disk_server for file_id in old_files)
+    raid.save_metadata()
+    assert not any((1, file_id) in disk_server for file_id in old_files)
+
+
+def test_unreachable_remote_disk_is_failed(base, disk_server, monkeypatch):
+    import src.cloud_implementation.api_client as client
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+    raid = make_array(base, files, is_local=False, segment_stripes=8)
+    get_disk_data, get_disks_data = client.get_disk_data, client.get_disks_data
+
+    def unreachable(disk_number):
+        if disk_number == 3:
+            raise ConnectionError(f"Download from disk {disk_number} failed")
+    monkeypatch.setattr(client, 'get_disk_data', lambda disk_number, *args: unreachable(disk_number) or get_disk_data(disk_number, *args))
+    monkeypatch.setattr(client, 'get_disks_data', lambda files: [unreachable(file[0]) for file in files] and get_disks_data(files))
+
+    # Reads continue in degraded mode, and opening the array finds the disk failed
+    assert {name: raid.read_file(name) for name in files} == files
+    assert raid.failed_disks == {3}
+    raid = open_array(base)
+    assert raid.failed_disks == {3}
+    assert {name: raid.read_file(name) for name in files} == files
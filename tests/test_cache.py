@@ -0,0 +1,119 @@
+import os
+
+from conftest import random_bytes, make_array, open_array
+from src.raid6.StripeCache import StripeCache
+
+
+CACHE_BYTES = 1 << 20
+
+
+def read_all(raid, files):
+    return {name: raid.read_file(name) for name in files}
+
+
+def add_file(base, raid, name, data):
+    with open(os.path.join(base, 'files', name), 'wb') as f:
+        f.write(data)
+    raid.distribute_data(base)
+
+
+def remove_file(base, raid, name):
+    os.remove(os.path.join(base, 'files', name))
+    raid.distribute_data(base)
+
+
+def test_lru_and_invalidate():
+    cache = StripeCache(max_bytes=30)
+    for stripe_index in range(3):
+        cache.put(stripe_index, bytes([stripe_index]) * 10)
+    assert cache.get(0) == bytes(10)
+    # Stripe 1 is the least recently used one
+    cache.put(3, b'3' * 10)
+    assert cache.get(1) is None and len(cache) == 3 and cache.size == 30 and cache.evictions == 1
+    cache.put(4, b'x' * 31)
+    assert cache.get(4) is None
+    cache.invalidate(2, 3)
+    assert cache.get(2) is None and cache.get(3) is not None
+    cache.invalidate(0)
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_update_range_through_cache(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+    raid = make_array(base, files, cache_bytes=CACHE_BYTES)
+    assert read_all(raid, files) == files
+    hits = raid.cache.hits
+    assert read_all(raid, files) == files
+    assert raid.cache.hits > hits
+
+    raid.update_range('a.jpg', 1000, b'x' * 200)
+    files['a.jpg'] = files['a.jpg'][:1000] + b'x' * 200 + files['a.jpg'][1200:]
+    assert read_all(raid, files) == files
+    assert raid.read_range('a.jpg', 990, 30) == files['a.jpg'][990:1020]
+
+
+def test_append_over_truncated_stripes_through_cache(base):
+    files = {'a.jpg': random_bytes(3000, seed=1)}
+    raid = make_array(base, files, cache_bytes=CACHE_BYTES)
+    add_file(base, raid, 'b.mp3', random_bytes(1000, seed=2))
+    start_stripe = raid.file_metadata['b.mp3']['start_stripe']
+    raid.read_file('b.mp3')
+
+    # The stripes of the deleted last file are cut off the disks and the next file is appended over them
+    remove_file(base, raid, 'b.mp3')
+    assert raid.total_stripes == start_stripe
+    new = random_bytes(1500, seed=3)
+    add_file(base, raid, 'c.pdf', new)
+    files['c.pdf'] = new
+    assert raid.file_metadata['c.pdf']['start_stripe'] == start_stripe
+    assert read_all(raid, files) == files
+
+
+def test_reused_free_extent_through_cache(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2), 'c.pdf': random_bytes(2000, seed=3)}
+    raid = make_array(base, files, cache_bytes=CACHE_BYTES)
+    assert read_all(raid, files) == files
+    middle = sorted(files, key=lambda name: raid.file_metadata[name]['start_stripe'])[1]
+    start_stripe = raid.file_metadata[middle]['start_stripe']
+    remove_file(base, raid, middle)
+    del files[middle]
+
+    new = random_bytes(500, seed=4)
+    add_file(base, raid, 'd.pdf', new)
+    files['d.pdf'] = new
+    assert raid.file_metadata['d.pdf']['start_stripe'] == start_stripe
+    assert read_all(raid, files) == files
+
+
+def test_compaction_through_cache(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2), 'c.pdf': random_bytes(2000, seed=3)}
+    raid = make_array(base, files, cache_bytes=CACHE_BYTES, max_inflight_stripes=4)
+    assert read_all(raid, files) == files
+    order = sorted(files, key=lambda name: raid.file_metadata[name]['start_stripe'])
+    remove_file(base, raid, order[0])
+    del files[order[0]]
+
+    # Every batch is read through the cache while the files move over stripes that were cached for others
+    while not raid.compact(max_stripes=4):
+        assert read_all(raid, files) == files
+    assert not raid.free_extents
+    assert read_all(raid, files) == files
+    assert read_all(open_array(base), files) == files
+
+
+def test_rebuild_through_cache(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+    raid = make_array(base, files, cache_bytes=CACHE_BYTES)
+    raid.delete_disk([1, 4])
+    # Reconstructed chunks are cached in degraded mode
+    assert read_all(raid, files) == files
+    raid.rebuild_data([1, 4], recover_files=False)
+    assert read_all(raid, files) == files
+
+    # An update after the rebuild is seen by degraded reads that decode from the rebuilt disks
+    raid.update_range('b.mp3', 0, b'y' * 300)
+    files['b.mp3'] = b'y' * 300 + files['b.mp3'][300:]
+    raid.delete_disk([0, 2])
+    assert read_all(raid, files) == files
+    raid.rebuild_data([0, 2], recover_files=False)
+    assert read_all(open_array(base), files) == files
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from conftest import random_bytes, make_array, open_array
+
+
+@pytest.mark.parametrize('kernel', ['numpy', 'stdlib'])
+def test_rebuild_with_free_extents(base, kernel):
+    if kernel == 'numpy':
+        pytest.importorskip('numpy')
+    files = {'a.jpg': random_bytes(500, seed=1), 'b.mp3': random_bytes(520, seed=2), 'c.pdf': random_bytes(510, seed=3)}
+    raid = make_array(base, files, chunk_size=16, num_disk=5, kernel=kernel)
+    middle = next(name for name, metadata in raid.file_metadata.items() if metadata['start_stripe'] == 11)
+    os.remove(os.path.join(base, 'files', middle))
+    raid.distribute_data(base)
+    del files[middle]
+    assert raid.free_extents == [[11, 11]]
+
+    # The free stripes were laid out for the deleted file, the rebuild must neither decode nor verify them
+    raid.delete_disk([0])
+    raid.rebuild_data([0], recover_files=False)
+    raid.delete_disk([1, 2])
+    raid.rebuild_data([1, 2], recover_files=False)
+    raid = open_array(base, kernel=kernel)
+    assert {name: raid.read_file(name) for name in files} == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors'] and not report['unrecoverable']
+
+    # A reused free extent gets new checksums
+    new = random_bytes(400, seed=4)
+    with open(os.path.join(base, 'files', 'd.pdf'), 'wb') as f:
+        f.write(new)
+    raid.distribute_data(base)
+    assert raid.file_metadata['d.pdf']['start_stripe'] == 11
+    raid.delete_disk([3, 4])
+    assert raid.read_file('d.pdf') == new
+    raid.rebuild_data([3, 4], recover_files=False)
+    report = open_array(base, kernel=kernel).scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_update_writes_checksums_in_place(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+    raid = make_array(base, files)
+    metadata_file = os.path.join(base, 'metadata.json')
+    checksum_file = os.path.join(base, 'checksums.bin')
+    metadata_mtime = os.stat(metadata_file).st_mtime_ns
+    generation = raid.generation
+
+    raid.update_range('a.jpg', 1000, b'x' * 100)
+    raid.update_range('b.mp3', 0, b'y')
+    # Only the touched entries of the checksum file change, the metadata and the disk labels are not rewritten
+    assert os.stat(metadata_file).st_mtime_ns == metadata_mtime and raid.generation == generation
+    assert os.path.getsize(checksum_file) == raid.total_stripes * raid.num_disk * raid.checksums.itemsize
+    files['a.jpg'] = files['a.jpg'][:1000] + b'x' * 100 + files['a.jpg'][1100:]
+    files['b.mp3'] = b'y' + files['b.mp3'][1:]
+    reopened = open_array(base)
+    assert reopened.checksums == raid.checksums and not reopened.failed_disks
+    assert {name: reopened.read_file(name) for name in files} == files
+    report = reopened.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+    # A degraded update saves the metadata, so the failed disk is stale when it comes back
+    disk_image = open(raid.backend.path(2), 'rb').read()
+    raid.delete_disk([2])
+    raid.update_range('a.jpg', 0, b'z' * 500)
+    assert raid.generation > generation
+    with open(raid.backend.path(2), 'wb') as f:
+        f.write(disk_image)
+    assert open_array(base).failed_disks == {2}
+
+
+def test_reload_repairs_corrupted_chunks(base):
+    files = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+    raid = make_array(base, files)
+    start_stripe = raid.file_metadata['a.jpg']['start_stripe']
+    disk_index = raid.layout.data_disks(start_stripe)[0]
+    with open(raid.backend.path(disk_index), 'r+b') as f:
+        f.seek(start_stripe * raid.chunk_size)
+        f.write(b'corrupted')
+
+    raid = open_array(base)
+    raid.load_existing_data()
+    reload_dir = os.path.join(base, 'Reloaded_Initial_distributed_files')
+    assert {name: open(os.path.join(reload_dir, f'pre_reloaded.{name}'), 'rb').read() for name in files} == files
+    # The bad chunk was written back repaired
+    report = raid.scrub(repair=False)
+    assert not report['checksum_errors'] and not report['parity_errors']
@@ -0,0 +1,154 @@
+import os
+
+import pytest
+
+from conftest import random_bytes, make_array, open_array
+
+
+def make_holey_array(base, sizes, deleted, **kwargs):
+    """Creates an array of files with the given sizes in stripes and frees the deleted ones; returns the RAID and the live files."""
+    files = {name: random_bytes(num_stripes * 64 - 10, seed=n) for n, (name, num_stripes) in enumerate(sizes.items())}
+    # The files are added one by one, so they are laid out in order
+    names = list(files)
+    raid = make_array(base, {names[0]: files[names[0]]}, **kwargs)
+    for name in names[1:]:
+        with open(os.path.join(base, 'files', name), 'wb') as f:
+            f.write(files[name])
+        raid.distribute_data(base)
+    for name in deleted:
+        os.remove(os.path.join(base, 'files', name))
+        del files[name]
+    raid.distribute_data(base)
+    return raid, files
+
+
+def read_all(raid, files):
+    return {name: raid.read_file(name) for name in files}
+
+
+@pytest.mark.parametrize('hole', [30, 5])
+def test_compact_in_batches(base, hole):
+    # 16 byte chunks on 6 disks make 64 byte stripes
+    raid, files = make_holey_array(base, {'a.jpg': 10, 'b.mp3': hole, 'c.pdf': 20, 'd.pdf': 3}, ['b.mp3'], max_inflight_stripes=4)
+    assert raid.free_extents == [[10, hole]]
+
+    copied = []
+    while not raid.compact(max_stripes=1):
+        # Every call copies one batch and leaves the files readable where the metadata says they are
+        copied.append(raid._move['copied'] if raid._move else None)
+        assert read_all(raid, files) == files
+        # A crash at any point leaves an array whose files are intact
+        assert read_all(open_array(base), files) == files
+    # c.pdf goes first, in batches of max_inflight_stripes stripes
+    assert copied[:6] == [4, 8, 12, 16, 20, 3]
+    assert not raid.free_extents and raid.total_stripes == 33
+    assert all(os.path.getsize(raid.backend.path(i)) == 33 * 16 for i in range(6))
+    raid = open_array(base)
+    assert read_all(raid, files) == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_writes_during_compaction(base):
+    raid, files = make_holey_array(base, {'a.jpg': 10, 'b.mp3': 30, 'c.pdf': 20, 'd.pdf': 12}, ['b.mp3'], max_inflight_stripes=4)
+    raid.compact(max_stripes=12)
+    assert raid._move['copied'] == 12
+
+    # A write to copied stripes rewinds the copy to them
+    raid.update_range('c.pdf', 5 * 64, b'new data')
+    files['c.pdf'] = files['c.pdf'][:320] + b'new data' + files['c.pdf'][328:]
+    assert raid._move['copied'] == 5
+    assert read_all(raid, files) == files
+    raid.compact(max_stripes=8)
+
+    # Deleting the file that is moved gives the move up
+    os.remove(os.path.join(base, 'files', 'c.pdf'))
+    raid.distribute_data(base)
+    del files['c.pdf']
+    raid.compact(max_stripes=1)
+    assert raid._move['metadata'] is raid.file_metadata['d.pdf']
+
+    # So does adding a file into the range the move copies to
+    new = random_bytes(500, seed=10)
+    with open(os.path.join(base, 'files', 'e.pdf'), 'wb') as f:
+        f.write(new)
+    raid.distribute_data(base)
+    files['e.pdf'] = new
+    assert raid._move is None
+    assert raid.compact()
+    assert not raid.free_extents
+    raid = open_array(base)
+    assert read_all(raid, files) == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_compaction_survives_disk_failures(base):
+    raid, files = make_holey_array(base, {'a.jpg': 10, 'b.mp3': 6, 'c.pdf': 20}, ['b.mp3'], max_inflight_stripes=4)
+    raid.compact(max_stripes=4)
+    raid.delete_disk([3])
+    assert raid._move is None
+    # Moves in degraded mode skip the failed disk, which gets the moved stripes back from the rebuild
+    assert raid.compact()
+    assert read_all(raid, files) == files
+    raid.rebuild_data([3], recover_files=False)
+    raid = open_array(base)
+    assert read_all(raid, files) == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_remote_compaction(base, disk_server):
+    # Written at once, the files share segments of 8 stripes, so copies into the hole replace segments holding live stripes
+    files = {name: random_bytes(12 * 64 - 10, seed=n) for n, name in enumerate(['a.jpg', 'b.mp3', 'c.pdf'])}
+    raid = make_array(base, files, is_local=False, segment_stripes=8, max_inflight_stripes=4)
+    middle = sorted(files, key=lambda name: raid.file_metadata[name]['start_stripe'])[1]
+    os.remove(os.path.join(base, 'files', middle))
+    del files[middle]
+    raid.distribute_data(base)
+    assert raid.free_extents == [[12, 12]]
+
+    while not raid.compact(max_stripes=4):
+        # The saved metadata refers to segments that still exist after every batch
+        assert read_all(open_array(base), files) == files
+    assert not raid.free_extents and raid.total_stripes == 24
+    raid = open_array(base)
+    assert not raid.failed_disks
+    assert read_all(raid, files) == files
+    # The replaced segments are deleted once nothing refers to them any more
+    referenced = {(int(disk), segment['file_id']) for disk, segments in raid.file_dict.items() for segment in segments}
+    referenced |= {(int(disk), file_id) for disk, file_id in raid.disk_labels.items()}
+    assert set(disk_server) == referenced
+
+
+def test_unsupported_file_during_compaction(base):
+    raid, files = make_holey_array(base, {'a.jpg': 10, 'b.mp3': 5, 'c.pdf': 20}, ['b.mp3'], max_inflight_stripes=4)
+    raid.compact(max_stripes=8)
+    # c.pdf does not fit into the hole and is copied behind the last stripe
+    assert raid._move['target'] == raid.total_stripes and raid._move['copied'] == 8
+
+    # Adding only an unsupported file appends nothing and leaves the copies alone
+    with open(os.path.join(base, 'files', '.DS_Store'), 'wb') as f:
+        f.write(b'x' * 100)
+    raid.distribute_data(base)
+    assert raid._move['copied'] == 8
+    assert raid.compact()
+    assert read_all(raid, files) == files
+
+
+def test_append_during_compaction(base):
+    raid, files = make_holey_array(base, {'a.jpg': 10, 'b.mp3': 5, 'c.pdf': 20}, ['b.mp3'], max_inflight_stripes=4)
+    raid.compact(max_stripes=8)
+    # An append cuts the disks back to the last stripe and so starts the move over
+    new = random_bytes(1000, seed=10)
+    with open(os.path.join(base, 'files', 'd.pdf'), 'wb') as f:
+        f.write(new)
+    raid.distribute_data(base)
+    files['d.pdf'] = new
+    assert raid._move is None
+    assert raid.compact()
+    assert read_all(raid, files) == files
+    raid = open_array(base)
+    assert read_all(raid, files) == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
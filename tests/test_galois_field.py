@@ -0,0 +1,104 @@
+import pytest
+
+from conftest import random_bytes
+from src.raid6.GaloisField import GF
+
+
+def reference_mul(x, y, primitive_polynomial=0x11d):
+    """Carry-less multiplication reduced by the primitive polynomial, bit by bit and without tables."""
+    product = 0
+    while y:
+        if y & 1:
+            product ^= x
+        y >>= 1
+        x <<= 1
+        if x & 0x100:
+            x ^= primitive_polynomial
+    return product
+
+
+def reference_inv(x):
+    return next(y for y in range(1, 256) if reference_mul(x, y) == 1)
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'stdlib'])
+def gf(request):
+    if request.param:
+        pytest.importorskip('numpy')
+    return GF(use_numpy=request.param)
+
+
+BUFFER = random_bytes(1000) + bytes(range(256))
+CONSTANTS = [0, 1, 2, 3, 0x1d, 0x80, 0xff]
+
+
+def test_scalar_ops(gf):
+    for x in range(256):
+        assert [gf.mul(x, y) for y in range(256)] == [reference_mul(x, y) for y in range(256)]
+        if x:
+            assert gf.inv(x) == reference_inv(x)
+            assert all(gf.mul(gf.div(y, x), x) == y for y in range(256))
+    with pytest.raises(ZeroDivisionError):
+        gf.div(5, 0)
+
+
+def test_mul_table(gf):
+    for c in CONSTANTS:
+        assert bytes(gf.mul_table(c)) == bytes(reference_mul(c, y) for y in range(256))
+
+
+def test_mul_vec_and_div_vec(gf):
+    for c in CONSTANTS:
+        assert bytes(gf.mul_vec(BUFFER, c)) == bytes(reference_mul(x, c) for x in BUFFER)
+        if c:
+            inverse = reference_inv(c)
+            assert bytes(gf.div_vec(BUFFER, c)) == bytes(reference_mul(x, inverse) for x in BUFFER)
+    with pytest.raises(ZeroDivisionError):
+        gf.div_vec(BUFFER, 0)
+
+
+def test_inv_of_a_buffer(gf):
+    values = bytes(range(1, 256))
+    assert bytes(gf.inv(values)) == bytes(reference_inv(x) for x in values)
+    with pytest.raises(ZeroDivisionError):
+        gf.inv(b'\x01\x00')
+
+
+def test_div_full():
+    pytest.importorskip('numpy')
+    gf = GF(use_numpy=True)
+    for y in range(1, 256):
+        inverse = reference_inv(y)
+        assert bytes(gf.div_full[:, y]) == bytes(reference_mul(x, inverse) for x in range(256))
+    assert not gf.div_full[:, 0].any()
+    assert not gf.div_full.flags.writeable
+
+
+def test_xor_mul_add_into_and_linear_combination(gf):
+    other = random_bytes(len(BUFFER), seed=1)
+    assert bytes(gf.xor(BUFFER, other)) == bytes(x ^ y for x, y in zip(BUFFER, other))
+    for c in CONSTANTS:
+        dst = bytearray(other)
+        gf.mul_add_into(dst, BUFFER, c)
+        assert dst == bytes(y ^ reference_mul(x, c) for x, y in zip(BUFFER, other))
+
+    sources = [random_bytes(300, seed=n) for n in range(4)]
+    coefficients = [0, 1, 7, 0xff]
+    expected = bytearray(300)
+    for source, coefficient in zip(sources, coefficients):
+        for i, x in enumerate(source):
+            expected[i] ^= reference_mul(x, coefficient)
+    assert bytes(gf.linear_combination(sources, coefficients)) == expected
+
+
+def test_inv_matrix(gf):
+    matrix = [[1, 1, 1], [1, 2, 4], [1, 3, 5]]
+    inverse = gf.inv_matrix(matrix)
+    for i in range(3):
+        for j in range(3):
+            value = 0
+            for k in range(3):
+                value ^= reference_mul(matrix[i][k], inverse[k][j])
+            assert value == int(i == j)
+    with pytest.raises(ValueError):
+        gf.inv_matrix([[1, 2], [2, 4]])
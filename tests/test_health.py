@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from conftest import random_bytes, make_array, open_array
+
+
+FILES = {'a.jpg': random_bytes(3001, seed=1), 'b.mp3': random_bytes(1333, seed=2)}
+
+
+@pytest.mark.parametrize('is_local', [True, False])
+def test_crash_after_writing_labels(base, is_local, request, monkeypatch):
+    if not is_local:
+        request.getfixturevalue('disk_server')
+    raid = make_array(base, FILES, is_local=is_local, segment_stripes=8)
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+    # The labels of the next generation are written, then the process dies before the metadata is saved
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+        patch.setattr(json, 'dump', crash)
+        raid.save_metadata()
+
+    raid = open_array(base)
+    assert not raid.failed_disks
+    assert {name: raid.read_file(name) for name in FILES} == FILES
+
+
+def make_stale(raid, disk_index):
+    """Takes a disk offline, updates the array in degraded mode and puts the old disk back, so its label is stale."""
+    image = open(raid.backend.path(disk_index), 'rb').read()
+    label = raid.backend.read_label(disk_index)
+    raid.delete_disk([disk_index])
+    raid.update_range('a.jpg', 10, b'new data')
+    raid.backend.write_at(disk_index, 0, image)
+    raid.backend.write_label(disk_index, label)
+    return dict(FILES, **{'a.jpg': FILES['a.jpg'][:10] + b'new data' + FILES['a.jpg'][18:]})
+
+
+def test_stale_disk_is_read_in_degraded_mode(base):
+    raid = make_array(base, FILES)
+    files = make_stale(raid, 2)
+    raid = open_array(base)
+    assert raid.failed_disks == {2}
+    assert {name: raid.read_file(name) for name in files} == files
+
+
+def test_auto_rebuild_of_a_stale_disk(base):
+    raid = make_array(base, FILES)
+    files = make_stale(raid, 2)
+    raid = open_array(base, auto_rebuild=True)
+    assert not raid.failed_disks
+    assert json.loads(raid.backend.read_label(2))['generation'] == raid.generation
+    raid = open_array(base)
+    assert not raid.failed_disks
+    assert {name: raid.read_file(name) for name in files} == files
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+def test_auto_rebuild_of_more_than_two_failed_disks(base):
+    raid = make_array(base, FILES)
+    make_stale(raid, 4)
+    raid.delete_disk([0, 1])
+    raid = open_array(base, auto_rebuild=True)
+    # Nothing can be rebuilt, the disks are only reported
+    assert raid.failed_disks == {0, 1, 4}
+    assert raid.backend.read_label(0) is None
+    with pytest.raises(ValueError):
+        raid.read_file('a.jpg')
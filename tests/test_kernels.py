@@ -0,0 +1,86 @@
+import sys
+import threading
+import importlib
+
+import pytest
+
+from conftest import random_bytes, make_array, open_array
+
+
+FILES = {'a.jpg': random_bytes(3001, seed=1), 'b.mp3': random_bytes(1333, seed=2), 'c.pdf': random_bytes(57, seed=3)}
+
+
+@pytest.fixture(params=['numpy', 'stdlib', 'no-numpy'])
+def kernel(request, monkeypatch):
+    """Yields the kernel to run the array with; 'no-numpy' re-imports the raid6 package with NumPy not importable."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    if request.param == 'no-numpy':
+        monkeypatch.setitem(sys.modules, 'numpy', None)
+        for name in [name for name in sys.modules if name.startswith('src.raid6')]:
+            monkeypatch.delitem(sys.modules, name)
+        raid6 = importlib.import_module('src.raid6.RAID6_bin')
+        monkeypatch.setattr(sys.modules['conftest'], 'RAID6', raid6.RAID6)
+        assert raid6.np is None
+        return None
+    return request.param
+
+
+def read_all(raid):
+    return {name: raid.read_file(name) for name in FILES}
+
+
+def test_encode_and_read(base, kernel):
+    raid = make_array(base, FILES, kernel=kernel)
+    assert raid.kernel == (kernel or 'stdlib')
+    assert read_all(raid) == FILES
+    assert read_all(open_array(base, kernel=kernel)) == FILES
+    data = FILES['a.jpg']
+    assert open_array(base, kernel=kernel).read_range('a.jpg', 100, 700) == data[100:800]
+    assert b''.join(raid.iter_file('b.mp3')) == FILES['b.mp3']
+
+
+def test_kernels_write_the_same_disks(base, kernel):
+    raid = make_array(base, FILES, kernel=kernel)
+    other = make_array(base + '_other', FILES, kernel='stdlib')
+    for disk_index in range(raid.num_disk):
+        with open(raid.backend.path(disk_index), 'rb') as f, open(other.backend.path(disk_index), 'rb') as g:
+            assert f.read() == g.read()
+
+
+@pytest.mark.parametrize('failed', [[0], [3], [1, 2], [0, 5]])
+def test_degraded_reads(base, kernel, failed):
+    raid = make_array(base, FILES, kernel=kernel)
+    raid.delete_disk(failed)
+    assert read_all(raid) == FILES
+    assert raid.read_range('a.jpg', 1000, 1500) == FILES['a.jpg'][1000:2500]
+    assert read_all(open_array(base, kernel=kernel)) == FILES
+
+
+@pytest.mark.parametrize('failed', [[2], [4, 1]])
+def test_rebuild(base, kernel, failed):
+    raid = make_array(base, FILES, kernel=kernel, max_inflight_stripes=8)
+    images = {}
+    for disk_index in failed:
+        with open(raid.backend.path(disk_index), 'rb') as f:
+            images[disk_index] = f.read()
+    raid.delete_disk(failed)
+    raid.rebuild_data(failed)
+    for disk_index in failed:
+        with open(raid.backend.path(disk_index), 'rb') as f:
+            assert f.read() == images[disk_index]
+    raid = open_array(base, kernel=kernel)
+    assert not raid.failed_disks
+    assert read_all(raid) == FILES
+    report = raid.scrub()
+    assert not report['checksum_errors'] and not report['parity_errors']
+
+
+@pytest.mark.parametrize('kernel_name, threaded', [('numpy', True), ('stdlib', False)])
+def test_blocks_use_threads_only_with_numpy(base, kernel_name, threaded):
+    if kernel_name == 'numpy':
+        pytest.importorskip('numpy')
+    raid = make_array(base, FILES, kernel=kernel_name, workers=4)
+    threads = set(raid._map_blocks(lambda n: threading.get_ident(), [(n,) for n in range(8)]))
+    assert (threads != {threading.get_ident()}) == threaded
+    assert read_all(raid) == FILES
@@ -0,0 +1,29 @@
+import pytest
+
+from conftest import random_bytes
+from src.raid6.RAID6_bin import RAID6
+
+
+@pytest.mark.parametrize('kernel', ['numpy', 'stdlib'])
+@pytest.mark.parametrize('chunk_size,num_disk', [(4, 4), (16, 5), (8, 7)])
+def test_compute_parity_matches_reference(base, kernel, chunk_size, num_disk):
+    if kernel == 'numpy':
+        pytest.importorskip('numpy')
+    raid = RAID6(chunk_size=chunk_size, num_disk=num_disk, dir=base, kernel=kernel)
+    num_stripes = 2 * num_disk + 1
+    raid.layout.extend(num_stripes)
+
+    matrix = []
+    for stripe_index in range(num_stripes):
+        stripe = [None] * num_disk
+        for disk_index in raid.layout.data_disks(stripe_index):
+            stripe[disk_index] = random_bytes(chunk_size, seed=stripe_index * num_disk + disk_index)
+        matrix.append(stripe)
+    # A short chunk at the end of a file is left out of the parity like a missing one
+    matrix[-1][raid.layout.data_disks(num_stripes - 1)[-1]] = b'\x01'
+
+    P_parity, Q_parity = raid.compute_parity(matrix)
+    P_reference, Q_reference = raid.compute_parity_reference(matrix)
+    for stripe_index in range(num_stripes):
+        assert bytes(P_parity[stripe_index]) == bytes(P_reference[stripe_index])
+        assert bytes(Q_parity[stripe_index]) == bytes(Q_reference[stripe_index])
@@ -0,0 +1,79 @@
+import os
+
+from conftest import random_bytes, make_array
+from src.raid6.ReadAhead import ReadAhead
+
+
+def make_readahead(max_stripes, num_disk=2, chunk_size=4):
+    """Returns a ReadAhead over disks whose chunk of stripe s is the bytes of s, and the list of (disk, start, stripes) reads issued."""
+    reads = []
+
+    def read_range(disk_index, start_stripe, num_stripes):
+        reads.append((disk_index, start_stripe, num_stripes))
+        return b''.join(bytes([stripe_index % 256]) * chunk_size for stripe_index in range(start_stripe, start_stripe + num_stripes))
+    return ReadAhead(read_range, num_disk, chunk_size, max_stripes), reads
+
+
+def expected(start_stripe, num_stripes, chunk_size=4):
+    return b''.join(bytes([stripe_index]) * chunk_size for stripe_index in range(start_stripe, start_stripe + num_stripes))
+
+
+def test_sequential_reads_hit_the_prefetched_ranges():
+    readahead, reads = make_readahead(max_stripes=8)
+    stream = (10, 30)
+    for start_stripe in range(10, 30, 4):
+        contents = readahead.read([0, 1], start_stripe, min(4, 30 - start_stripe), stream)
+        assert contents == {disk_index: expected(start_stripe, min(4, 30 - start_stripe)) for disk_index in (0, 1)}
+    # Only the first read waits for the disks, the others were prefetched, and nothing is read past the file
+    assert readahead.used_stripes == 16 and readahead.dropped_stripes == 0
+    assert sorted(start for disk_index, start, _ in reads if disk_index == 0) == [10, 14, 18, 22, 26]
+    assert max(start + stripes for _, start, stripes in reads) == 30
+    readahead.close()
+
+
+def test_a_new_stream_drops_the_ranges_prefetched_for_another():
+    readahead, reads = make_readahead(max_stripes=8)
+    readahead.read([0, 1], 100, 4, (100, 200))
+    readahead.read([0, 1], 104, 4, (100, 200))
+    assert readahead.prefetched
+
+    # The first read of another file is sequential and prefetches for that file only
+    readahead.read([0, 1], 0, 4, (0, 100))
+    assert all(start < 100 for start, _, _ in readahead.prefetched)
+    assert readahead.prefetched_stripes > 12
+    for start_stripe in range(4, 100, 4):
+        assert readahead.read([0, 1], start_stripe, 4, (0, 100))[0] == expected(start_stripe, 4)
+    assert not readahead.prefetched
+    readahead.close()
+
+
+def test_reads_after_an_abandoned_file_read(base):
+    files = {'a.jpg': random_bytes(40 * 64 - 5, seed=1), 'b.pdf': random_bytes(40 * 64 - 5, seed=2)}
+    raid = make_array(base, {'a.jpg': files['a.jpg']}, max_inflight_stripes=4)
+    with open(os.path.join(base, 'files', 'b.pdf'), 'wb') as f:
+        f.write(files['b.pdf'])
+    raid.distribute_data(base)
+    b_start = raid.file_metadata['b.pdf']['start_stripe']
+
+    blocks = raid.iter_file('b.pdf')
+    next(blocks)
+    next(blocks)
+    prefetched = raid.readahead.prefetched_stripes
+    assert raid.read_file('a.jpg') == files['a.jpg']
+    # a.jpg was prefetched, and the ranges of b.pdf were dropped
+    assert raid.readahead.prefetched_stripes > prefetched
+    assert all(start < b_start for start, _, _ in raid.readahead.prefetched)
+
+
+def test_writes_invalidate_prefetched_ranges(base):
+    data = random_bytes(40 * 64 - 5, seed=1)
+    raid = make_array(base, {'a.jpg': data}, max_inflight_stripes=4)
+    blocks = raid.iter_file('a.jpg')
+    head = next(blocks) + next(blocks)
+    assert raid.readahead.prefetched
+
+    # The stripes written are already prefetched, the rest of the read must see the new data
+    raid.update_range('a.jpg', 10 * 64, b'new data')
+    assert not raid.readahead.prefetched
+    data = data[:640] + b'new data' + data[648:]
+    assert head + b''.join(blocks) == data
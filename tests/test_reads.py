@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import random_bytes, make_array
+
+
+FILES = {'a.jpg': random_bytes(3001, seed=1), 'b.pdf': random_bytes(1333, seed=2)}
+
+
+def test_read_range(base):
+    raid = make_array(base, FILES)
+    data = FILES['b.pdf']
+    for offset, size in [(0, 1333), (0, 1), (63, 2), (64, 64), (100, 5000), (1332, 10)]:
+        assert raid.read_range('b.pdf', offset, size) == data[offset:offset + size]
+    assert raid.read_range('b.pdf', 1333, 10) == b''
+    assert raid.read_range('b.pdf', 10, 0) == b''
+
+
+@pytest.mark.parametrize('offset, size', [(-10, 20), (0, -1), (-1, -1)])
+def test_read_range_rejects_negative_arguments(base, offset, size):
+    raid = make_array(base, FILES)
+    with pytest.raises(ValueError):
+        raid.read_range('b.pdf', offset, size)
+    with pytest.raises(FileNotFoundError):
+        raid.read_range('missing.pdf', 0, 10)
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+pytest.importorskip('mongomock')
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from conftest import random_bytes
+from src.cloud_implementation import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A client of the server with its disks kept in memory by mongomock."""
+    monkeypatch.setattr(server, 'DISK_BACKEND', 'mongomock')
+    monkeypatch.setattr(server, '_disk_fs', {})
+    return TestClient(server.app)
+
+
+def upload(client, disk_number, data):
+    response = client.post(f'/disks/{disk_number}/files', content=data)
+    assert response.status_code == 200
+    return response.text
+
+
+def test_binary_upload_and_download(client, monkeypatch):
+    # Bodies larger than a stream piece are written and read in several pieces
+    monkeypatch.setattr(server, 'STREAM_CHUNK_SIZE', 1000)
+    data = random_bytes(4500)
+    file_id = upload(client, 2, data)
+
+    response = client.get(f'/disks/2/files/{file_id}')
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers['content-length'] == str(len(data))
+    assert response.headers['accept-ranges'] == 'bytes'
+
+    # Each disk is its own store
+    assert client.get(f'/disks/3/files/{file_id}').status_code == 404
+
+    assert upload(client, 2, b'') != file_id
+    assert client.delete(f'/disks/2/files/{file_id}').status_code == 200
+    assert client.get(f'/disks/2/files/{file_id}').status_code == 404
+
+
+@pytest.mark.parametrize('range_header,start,end', [
+    ('bytes=10-19', 10, 20),
+    ('bytes=990-', 990, 1000),
+    ('bytes=-25', 975, 1000),
+    ('bytes=500-5000', 500, 1000),
+    ('Bytes=0-9', 0, 10),
+])
+def test_range_download(client, range_header, start, end):
+    data = random_bytes(1000)
+    file_id = upload(client, 0, data)
+
+    response = client.get(f'/disks/0/files/{file_id}', headers={'Range': range_header})
+    assert response.status_code == 206
+    assert response.content == data[start:end]
+    assert response.headers['content-range'] == f'bytes {start}-{end - 1}/1000'
+    assert response.headers['content-length'] == str(end - start)
+
+
+@pytest.mark.parametrize('range_header', ['bytes=1000-', 'bytes=20-10', 'bytes=-', 'bytes=a-b'])
+def test_unsatisfiable_range(client, range_header):
+    file_id = upload(client, 1, random_bytes(1000))
+
+    response = client.get(f'/disks/1/files/{file_id}', headers={'Range': range_header})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == 'bytes */1000'
+
+
+@pytest.mark.parametrize('range_header', ['items=0-10', 'Items=0-10', 'none'])
+def test_unknown_range_unit_is_ignored(client, range_header):
+    data = random_bytes(1000)
+    file_id = upload(client, 1, data)
+
+    response = client.get(f'/disks/1/files/{file_id}', headers={'Range': range_header})
+    assert response.status_code == 200
+    assert response.content == data
+    assert 'content-range' not in response.headers
+
+
+def test_missing_file(client):
+    response = client.get(f'/disks/0/files/{ObjectId()}')
+    assert response.status_code == 404
+    response = client.get(f'/disks/0/files/{ObjectId()}', headers={'Range': 'bytes=0-10'})
+    assert response.status_code == 404
@@ -0,0 +1,68 @@
+import os
+import pstats
+
+from conftest import random_bytes, make_array
+from src.raid6.Stats import Stats
+
+
+FILES = {'a.jpg': random_bytes(3000, seed=1), 'b.mp3': random_bytes(1000, seed=2)}
+
+
+def test_phase_counters_and_callbacks():
+    stats = Stats()
+    steps = []
+    stats.add_callback(lambda phase, seconds, num_bytes: steps.append((phase, num_bytes)))
+    stats.add('read', 0.5, 100)
+    with stats.phase('encode', 10):
+        pass
+    assert steps == [('read', 100), ('encode', 10)]
+    counters = stats.as_dict()
+    assert counters['read'] == {'seconds': 0.5, 'bytes': 100, 'calls': 1}
+    assert counters['encode']['bytes'] == 10 and counters['encode']['calls'] == 1
+    assert set(counters) == set(Stats.PHASES)
+    stats.reset()
+    assert all(counter == {'seconds': 0.0, 'bytes': 0, 'calls': 0} for counter in stats.as_dict().values())
+
+
+def test_array_phases(base):
+    raid = make_array(base, {}, max_inflight_stripes=4)
+    steps = []
+    raid.stats.add_callback(lambda phase, seconds, num_bytes: steps.append((phase, num_bytes)))
+    for name, data in FILES.items():
+        with open(os.path.join(base, 'files', name), 'wb') as f:
+            f.write(data)
+    raid.distribute_data(base)
+    size = sum(len(data) for data in FILES.values())
+    counters = raid.stats.as_dict()
+    # The files are read, laid out and encoded once, block by block
+    assert counters['read']['bytes'] == size and counters['encode']['bytes'] == size and counters['stripe']['bytes'] == size
+    assert counters['encode']['calls'] > len(FILES)
+    assert counters['verify']['bytes'] > 0 and counters['write']['bytes'] > size
+    assert counters['decode']['calls'] == 0 and counters['network']['calls'] == 0
+    # The callbacks saw every step
+    for phase in Stats.PHASES:
+        assert sum(num_bytes for step_phase, num_bytes in steps if step_phase == phase) == counters[phase]['bytes']
+
+    raid.stats.reset()
+    raid.delete_disk([2])
+    assert raid.read_file('a.jpg') == FILES['a.jpg']
+    counters = raid.stats.as_dict()
+    assert counters['decode']['bytes'] > 0 and counters['read']['bytes'] > 0 and counters['encode']['calls'] == 0
+
+
+def test_remote_disk_io_is_network_time(base, disk_server):
+    raid = make_array(base, FILES, is_local=False)
+    raid.stats.reset()
+    raid.read_file('a.jpg')
+    counters = raid.stats.as_dict()
+    assert counters['network']['calls'] > 0 and counters['read']['calls'] == 0
+
+
+def test_profile_dir(base):
+    profile_dir = os.path.join(base, 'profiles')
+    raid = make_array(base, FILES, profile_dir=profile_dir)
+    raid.read_file('a.jpg')
+    profiles = sorted(os.listdir(profile_dir))
+    # Nested operations are part of the outer operation's profile
+    assert profiles == ['distribute_data_1.prof', 'read_file_2.prof']
+    assert pstats.Stats(os.path.join(profile_dir, profiles[1])).total_calls > 0